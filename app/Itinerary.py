@@ -1,19 +1,25 @@
 
+import numpy as np
 import pandas as pd
 from sklearn.preprocessing import MinMaxScaler
-from sklearn.cluster import KMeans
 import random
-from app import db
-from app.models import POI
-from math import radians, cos, sin, sqrt, atan2
+import time
+from app.cache import ClusterResult, cluster_cache
+from app.clustering import clustering_backend
+from app.routing import route_pool
+from app import distance
+from app.metrics import timed, kmeans_iterations, route_moves
+from app.activities import ACTIVITY_COLS
 
-# Load and prepare the POI dataset
-def load_poi_data():
+# Load and prepare a city's POI dataset
+@timed('load_poi_data')
+def load_poi_data(path):
     # Load POI dataset
-    df = pd.read_csv('dataset/London_cleaned_with_all_pois.csv')
+    df = pd.read_csv(path)
     
     # Drop POIs that don't have coordinates (not usable for clustering or mapping)
-    df = df.dropna(subset=['Latitude', 'Longitude'])
+    # and renumber rows so positions line up with the catalog arrays
+    df = df.dropna(subset=['Latitude', 'Longitude']).reset_index(drop=True)
 
     # Store original coordinates for display or mapping later
     df['Original_Latitude'] = df['Latitude']
@@ -31,37 +37,63 @@ def normalize_coordinates(df):
     return df
 
 # Filter POIs based on user-selected activities
-def filter_pois_by_activity(df, selected_activities):
-    # Keep only POIs that match at least one of the selected activities
-    df = df[df[selected_activities].sum(axis=1) > 0].reset_index(drop=True)
-    return df
+@timed('filter_pois_by_activity')
+def filter_pois_by_activity(catalog, selected_activities):
+    # Row indices of POIs that match at least one of the selected activities
+    # (looked up in the catalog's activity bitmap, no DataFrame is copied)
+    return catalog.match_activities(selected_activities)
 
 # Apply K-Means clustering using number of clusters = number of days
-def apply_kmeans(df, days):
-    activity_cols = [
-        'nature', 'nightlife', 'drink', 'music', 'dance', 'history',
-        'sports', 'art', 'museum', 'walk', 'restaurant', 'movie'
-    ]
-    X = df[['Norm_Latitude', 'Norm_Longitude'] + activity_cols].values
-
-    # Set the number of clusters equal to number of trip days
-    kmeans = KMeans(n_clusters=days, random_state=42)
-    df['cluster'] = kmeans.fit_predict(X)
-    return df, kmeans
+# (over normalized coordinates + activity flags; the backend picks full or mini-batch KMeans for the catalog size)
+@timed('apply_kmeans')
+def apply_kmeans(catalog, rows, days, backend=clustering_backend):
+    labels, kmeans = backend.fit(catalog, rows, days)
+    kmeans_iterations.observe(kmeans.n_iter_)
+    return labels, kmeans
 
 # Select multiple POIs (default 5) per cluster based on proximity to cluster center
-def select_representative_pois(df, kmeans, pois_per_day=5):
+@timed('select_representative_pois')
+def select_representative_pois(catalog, rows, labels, centers, pois_per_day=5):
+    # Group the filtered rows by cluster once (stable, so rows stay in catalog order)
+    by_cluster = np.argsort(labels, kind='stable')
+    bounds = np.concatenate([[0], np.cumsum(np.bincount(labels, minlength=len(centers)))])
+
     representative_pois = []
-    for cluster_num in range(len(kmeans.cluster_centers_)):
-        cluster_group = df[df['cluster'] == cluster_num]
-        if not cluster_group.empty:
-            center = kmeans.cluster_centers_[cluster_num]
-            cluster_group = cluster_group.copy()
-            cluster_group['dist'] = ((cluster_group['Norm_Latitude'] - center[0])**2 + 
-                                     (cluster_group['Norm_Longitude'] - center[1])**2)
+    for cluster_num in range(len(centers)):
+        members = rows[by_cluster[bounds[cluster_num]:bounds[cluster_num + 1]]]
+        if len(members):
+            center = centers[cluster_num]
+
+            # Membership test for spatial index candidates (rows is sorted, so a binary search is enough)
+            def is_member(candidates, cluster_num=cluster_num):
+                pos = np.minimum(np.searchsorted(rows, candidates), len(rows) - 1)
+                return (rows[pos] == candidates) & (labels[pos] == cluster_num)
+
             # Select top N closest POIs
-            selected = cluster_group.sort_values('dist').head(pois_per_day)
-            representative_pois.extend(selected.to_dict(orient='records'))
+            closest = catalog.spatial_index.nearest_members(center[:2], pois_per_day, members, is_member)
+            representative_pois.extend(catalog.records(closest))
+    return representative_pois
+
+# Cluster the POIs matching the selected activities, reusing cached results when possible
+# (KMeans uses a fixed seed, so the output only depends on the dataset, activities, days and backend settings)
+@timed('cluster_pois')
+def cluster_pois(catalog, selected_activities, days, cache=cluster_cache, backend=clustering_backend):
+    key = cache.make_key(catalog.version, selected_activities, days, backend.signature())
+    result = cache.get(key)
+    if result is None:
+        rows = filter_pois_by_activity(catalog, selected_activities)
+        labels, kmeans = apply_kmeans(catalog, rows, days, backend)
+        result = ClusterResult(rows, labels, kmeans.cluster_centers_)
+        cache.put(key, result)
+    return result
+
+# Representative POIs for a planning request (filter + clustering + selection, all cached)
+def plan_representative_pois(catalog, selected_activities, days, pois_per_day=5, cache=cluster_cache):
+    result = cluster_pois(catalog, selected_activities, days, cache)
+    representative_pois = result.representatives.get(pois_per_day)
+    if representative_pois is None:
+        representative_pois = select_representative_pois(catalog, result.rows, result.labels, result.centers, pois_per_day)
+        result.representatives[pois_per_day] = representative_pois
     return representative_pois
 
 # Helper to split a list into N approximately equal parts
@@ -71,40 +103,129 @@ def split_list(lst, n):
 
 # Haversine formula to calculate distance between two geo-points
 def calculate_haversine_distance(poi1, poi2):
-    lat1, lon1 = radians(poi1['latitude']), radians(poi1['longitude'])
-    lat2, lon2 = radians(poi2['latitude']), radians(poi2['longitude'])
+    return float(distance.haversine(poi1['latitude'], poi1['longitude'], poi2['latitude'], poi2['longitude']))
 
-    dlat = lat2 - lat1
-    dlon = lon2 - lon1
-    a = sin(dlat / 2)**2 + cos(lat1) * cos(lat2) * sin(dlon / 2)**2
-    c = 2 * atan2(sqrt(a), sqrt(1 - a))
-    radius = 6371  # Earth radius in kilometers
-    return radius * c
+# Latitudes and longitudes of a list of POIs as arrays
+def poi_coordinates(itinerary):
+    lats = np.array([poi['latitude'] for poi in itinerary], dtype=np.float64)
+    lons = np.array([poi['longitude'] for poi in itinerary], dtype=np.float64)
+    return lats, lons
 
-# 2-opt algorithm to optimize visit order by reducing travel distance
-def opt2(itinerary):
+# Smallest change in route length (km) that counts as an improvement
+IMPROVEMENT_EPSILON = 1e-9
+
+# One 2-opt pass over the route (an open path, first stop fixed); returns the number of reversals made
+# Reversing order[i..j] only replaces the edges around the segment, so each move is priced in O(1)
+def _two_opt_pass(order, dist, deadline):
+    n = len(order)
+    moves = 0
+    for i in range(1, n - 1):
+        if deadline is not None and time.perf_counter() > deadline:
+            break
+        a, b = order[i - 1], order[i]
+        for j in range(i + 1, n):
+            c = order[j]
+            if j == n - 1:
+                delta = dist[a][c] - dist[a][b]
+            else:
+                e = order[j + 1]
+                delta = dist[a][c] + dist[b][e] - dist[a][b] - dist[c][e]
+            if delta < -IMPROVEMENT_EPSILON:
+                order[i:j + 1] = order[i:j + 1][::-1]
+                b = order[i]
+                moves += 1
+    return moves
+
+# One Or-opt pass: move a segment of 1-3 stops (optionally reversed) to a cheaper place in the route
+# Returns the number of segments moved
+def _or_opt_pass(order, dist, deadline):
+    n = len(order)
+    moves = 0
+    for length in (1, 2, 3):
+        i = 1
+        while i + length <= n:
+            if deadline is not None and time.perf_counter() > deadline:
+                return moves
+            prev, first, last = order[i - 1], order[i], order[i + length - 1]
+            nxt = order[i + length] if i + length < n else None
+
+            # Length saved by taking the segment out of its current place
+            removal_gain = dist[prev][first] - (dist[prev][nxt] if nxt is not None else 0)
+            if nxt is not None:
+                removal_gain += dist[last][nxt]
+
+            best = None
+            for p in range(n):
+                if i - 1 <= p <= i + length - 1:
+                    continue
+                u = order[p]
+                v = order[p + 1] if p + 1 < n else None
+                base = -dist[u][v] if v is not None else 0
+                for reverse in (False, True):
+                    head, tail = (last, first) if reverse else (first, last)
+                    added = base + dist[u][head] + (dist[tail][v] if v is not None else 0)
+                    delta = added - removal_gain
+                    if delta < -IMPROVEMENT_EPSILON and (best is None or delta < best[0]):
+                        best = (delta, p, reverse)
+
+            if best is None:
+                i += 1
+                continue
+
+            _, p, reverse = best
+            segment = order[i:i + length]
+            if reverse:
+                segment.reverse()
+            del order[i:i + length]
+            insert_at = p + 1 if p < i else p + 1 - length
+            order[insert_at:insert_at] = segment
+            moves += 1
+    return moves
+
+# Visiting order for stops at these coordinates (first stop fixed), improved with 2-opt and Or-opt moves
+# Returns (order, 2-opt reversals, Or-opt moves); takes plain arrays so it can also run in the route pool
+def optimize_order(lats, lons, or_opt=True, time_budget=None, method='haversine'):
+    dist = distance.pairwise(lats, lons, method).tolist()  # Nested lists are faster than NumPy for scalar lookups
+    order = list(range(len(lats)))
+    deadline = time.perf_counter() + time_budget if time_budget is not None else None
+
+    total_swaps = total_moves = 0
     improved = True
     while improved:
-        improved = False
-        for i in range(1, len(itinerary) - 1):
-            for j in range(i + 1, len(itinerary)):
-                new_itinerary = itinerary[:i] + itinerary[i:j + 1][::-1] + itinerary[j + 1:]
-                if calculate_total_distance(new_itinerary) < calculate_total_distance(itinerary):
-                    itinerary = new_itinerary
-                    improved = True
-                    break
-            if improved:
-                break
-    return itinerary
+        swaps = _two_opt_pass(order, dist, deadline)
+        moves = _or_opt_pass(order, dist, deadline) if or_opt else 0
+        total_swaps += swaps
+        total_moves += moves
+        improved = swaps or moves
+        if deadline is not None and time.perf_counter() > deadline:
+            break
+    return order, total_swaps, total_moves
+
+# Count the optimizer's moves (done by the caller, since pool processes have their own metrics)
+def record_route_moves(swaps, moves):
+    route_moves.inc(swaps, move='2-opt')
+    route_moves.inc(moves, move='or-opt')
+
+# 2-opt algorithm to optimize visit order by reducing travel distance
+# Uses a precomputed distance matrix, optional Or-opt moves and an optional time budget (seconds)
+@timed('opt2')
+def opt2(itinerary, or_opt=True, time_budget=None, method='haversine'):
+    if len(itinerary) < 3:
+        return itinerary
+
+    lats, lons = poi_coordinates(itinerary)
+    order, swaps, moves = optimize_order(lats, lons, or_opt, time_budget, method)
+    record_route_moves(swaps, moves)
+    return [itinerary[k] for k in order]
 
 # Total travel distance for an itinerary (used in optimization)
 def calculate_total_distance(itinerary):
-    total_distance = 0
-    for i in range(len(itinerary) - 1):
-        total_distance += calculate_haversine_distance(itinerary[i], itinerary[i + 1])
-    return total_distance
+    lats, lons = poi_coordinates(itinerary)
+    return distance.path_length(lats, lons)
 
-# Build final itineraries grouped by day, and optionally store them in the database
+# Build final itineraries grouped by day
+# (nothing is written to the database here; save_itinerary persists the plan the user keeps)
+@timed('generate_itineraries')
 def generate_itineraries(representative_pois, selected_activities, days):
     # Remove duplicates by name (in case one POI ends up in multiple clusters)
     unique_pois = {poi['name']: poi for poi in representative_pois}
@@ -131,25 +252,12 @@ def generate_itineraries(representative_pois, selected_activities, days):
             day_itinerary.append(poi_data)
         itineraries.append(day_itinerary)
 
-    # Optimize order of visits for each day
-    for i in range(len(itineraries)):
-        itineraries[i] = opt2(itineraries[i])
-
-    # Save the final POIs to the database
-    for itinerary in itineraries:
-        for poi_data in itinerary:
-            poi_instance = POI(
-                name=poi_data.get('name'),
-                address=poi_data.get('address'),
-                latitude=poi_data.get('latitude'),
-                longitude=poi_data.get('longitude'),
-                original_latitude=poi_data.get('latitude'),
-                original_longitude=poi_data.get('longitude'),
-                day=poi_data.get('day'),
-                itinerary_id=1  # itinerary ID
-            )
-            db.session.add(poi_instance)
-    db.session.commit()
-
-    return itineraries
+    # Optimize order of visits for each day (long days run in parallel on the route pool)
+    return route_pool.optimize_days(itineraries)
+
+# Full planning pipeline for one request: representative POIs, then day-by-day itineraries
+@timed('plan_itineraries')
+def plan_itineraries(catalog, selected_activities, days, pois_per_day=5):
+    representative_pois = plan_representative_pois(catalog, selected_activities, days, pois_per_day)
+    return generate_itineraries(representative_pois, selected_activities, days)
 
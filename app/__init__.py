@@ -18,17 +18,65 @@ def create_app():
     # Load settings from the config file inside the instance folder
     app.config.from_pyfile('../instance/config.py')
 
-    # Define the path for file uploads (e.g., blogs, vlogs)
+    # Folder of files uploaded before the media store (still served as static files)
     app.config['UPLOAD_FOLDER'] = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'static', 'uploads')
 
+    # Default city's POI dataset (other cities are found next to it, see CITY_DATASET_DIR)
+    app.config.setdefault('POI_DATASET_PATH', os.path.join(os.path.dirname(os.path.abspath(os.path.dirname(__file__))), 'dataset', 'London_cleaned_with_all_pois.csv'))
+
+    # Uploaded files are kept in a content-addressed store (see app/uploads.py); partial uploads are written
+    # to the temp folder, on the same filesystem, and moved in when complete
+    app.config['UPLOAD_STORE_FOLDER'] = app.config.get('UPLOAD_STORE_FOLDER') or os.path.join(os.path.abspath(os.path.dirname(__file__)), 'media')
+    app.config.setdefault('UPLOAD_TMP_FOLDER', os.path.join(os.path.abspath(os.path.dirname(__file__)), 'upload_tmp'))
+
     # Ensure the upload folder exists
     os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
+    # Stream uploaded files to disk as the request body is read (hashing them and enforcing size caps on the way)
+    from .uploads import StreamingUploadRequest
+    app.request_class = StreamingUploadRequest
+
+    # Choose the database (DATABASE_URL overrides the config file) and its connection pool/timeouts
+    from .database import configure_database, tune_engine
+    configure_database(app)
+
     # Initialize all extensions with the app
     bcrypt.init_app(app)
     db.init_app(app)
     login_manager.init_app(app)
 
+    # Configure the clustering result and rendered map caches
+    from .cache import cluster_cache, map_cache
+    cluster_cache.init_app(app)
+    map_cache.init_app(app)
+
+    # Request/stage metrics exported at /metrics (and optional profiling of slow requests)
+    from . import metrics
+    metrics.init_app(app)
+    metrics.register_cache('cluster', cluster_cache)
+    metrics.register_cache('map', map_cache)
+
+    # Per-city POI catalogs, loaded on demand
+    from .catalog import city_catalogs
+    city_catalogs.init_app(app)
+    metrics.register_cache('catalog', city_catalogs)
+
+    # Choose the clustering algorithm and its iteration budget
+    from .clustering import clustering_backend
+    clustering_backend.init_app(app)
+
+    # Process pool for route optimization of long days
+    from .routing import route_pool
+    route_pool.init_app(app)
+
+    # Rate limits, concurrency cap and size bounds for planning requests
+    from .admission import admission
+    admission.init_app(app)
+
+    # Configure the background queue used for itinerary generation
+    from .jobs import planning_queue
+    planning_queue.init_app(app)
+
     # Import the User model here to avoid circular imports
     from .models import User
 
@@ -37,11 +85,29 @@ def create_app():
     def load_user(user_id):
         return User.query.get(int(user_id))
 
+    # API clients can authenticate with a key from API_KEYS (Authorization: Bearer <key>) instead of a session
+    @login_manager.request_loader
+    def load_user_from_api_key(request):
+        auth = request.headers.get('Authorization', '')
+        if auth.startswith('Bearer '):
+            username = app.config.get('API_KEYS', {}).get(auth[len('Bearer '):])
+            if username:
+                return User.query.filter_by(username=username).first()
+        return None
+
     # Import and register the blueprint with routes after initializing the app
     from .routes import main
     app.register_blueprint(main)
 
-    return app
+    # JSON API (batch itinerary planning)
+    from .api import api
+    app.register_blueprint(api)
+
+    # Create any tables that don't exist yet (e.g. planning jobs), then add newer columns and indexes to existing ones
+    from .schema import upgrade_schema
+    with app.app_context():
+        tune_engine(db.engine, app.config)
+        db.create_all()
+        upgrade_schema()
 
-# Create the app instance
-app = create_app()
+    return app
@@ -0,0 +1,6 @@
+# Activity flag columns present in every POI dataset
+# (kept apart from the planning engine so forms and views can use them without importing pandas/scikit-learn)
+ACTIVITY_COLS = [
+    'nature', 'nightlife', 'drink', 'music', 'dance', 'history',
+    'sports', 'art', 'museum', 'walk', 'restaurant', 'movie'
+]
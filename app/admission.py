@@ -0,0 +1,114 @@
+import math
+import threading
+import time
+from werkzeug.exceptions import TooManyRequests
+from app.cache import LRUCache
+from app.metrics import planning_admissions
+
+# Token bucket: refills at `rate` tokens per second, up to `burst` tokens
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    # Seconds until `cost` tokens are available (0 if they are available now); callers hold the lock
+    def wait_time(self, cost, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= cost:
+            return 0.0
+        if cost > self.burst or self.rate <= 0:
+            return math.inf
+        return (cost - self.tokens) / self.rate
+
+# Admission control for the planning pipeline (per worker process)
+# A plan is admitted only if a concurrency slot is free and both the user's and the global token bucket
+# have enough tokens; otherwise it is refused at once with 429 and a Retry-After hint, instead of queueing
+# behind the CPU-bound work already running
+# API plans (batches of many itineraries) are charged to a separate, larger bucket per caller instead
+class AdmissionControl:
+    def __init__(self, user_rate=6, user_burst=3, global_rate=60, global_burst=20, api_rate=600, api_burst=60,
+                 max_concurrent=8, max_days=7, max_pois_per_day=10, busy_retry_after=5):
+        self.user_rate = user_rate            # Plans per minute per user
+        self.user_burst = user_burst          # Plans a user can queue at once after being idle
+        self.global_rate = global_rate        # Plans per minute for all users together
+        self.global_burst = global_burst
+        self.api_rate = api_rate              # API plans per minute per caller
+        self.api_burst = api_burst
+        self.max_concurrent = max_concurrent  # Plans queued or running at the same time (0 = no limit)
+        self.max_days = max_days              # Largest trip length accepted
+        self.max_pois_per_day = max_pois_per_day
+        self.busy_retry_after = busy_retry_after  # Retry-After (seconds) when every slot is taken
+        self._user_buckets = LRUCache(10000)  # user ID -> TokenBucket (idle users are evicted first)
+        self._api_buckets = LRUCache(10000)
+        self._global_bucket = None
+        self._active = 0
+        self._lock = threading.Lock()
+
+    # Configure the limits from the app settings (same pattern as the Flask extensions)
+    def init_app(self, app):
+        self.user_rate = app.config.get('PLAN_USER_RATE', self.user_rate)
+        self.user_burst = app.config.get('PLAN_USER_BURST', self.user_burst)
+        self.global_rate = app.config.get('PLAN_GLOBAL_RATE', self.global_rate)
+        self.global_burst = app.config.get('PLAN_GLOBAL_BURST', self.global_burst)
+        self.api_rate = app.config.get('PLAN_API_RATE', self.api_rate)
+        self.api_burst = app.config.get('PLAN_API_BURST', self.api_burst)
+        self.max_concurrent = app.config.get('MAX_CONCURRENT_PLANS', self.max_concurrent)
+        self.max_days = app.config.get('MAX_TRIP_DAYS', self.max_days)
+        self.max_pois_per_day = app.config.get('MAX_POIS_PER_DAY', self.max_pois_per_day)
+        self._global_bucket = None
+
+    # Raise ValueError (with a message for the user) if a plan is larger than allowed
+    def check_bounds(self, days, pois_per_day=5):
+        if not 1 <= days <= self.max_days:
+            raise ValueError('days must be between 1 and %d' % self.max_days)
+        if not 1 <= pois_per_day <= self.max_pois_per_day:
+            raise ValueError('pois_per_day must be between 1 and %d' % self.max_pois_per_day)
+
+    def _refuse(self, reason, retry_after):
+        planning_admissions.inc(result=reason)
+        raise TooManyRequests('Too many itinerary requests, please try again shortly.',
+                              retry_after=max(1, math.ceil(min(retry_after, 3600))))
+
+    def _bucket(self, buckets, user_id, rate, burst):
+        bucket = buckets.get(user_id)
+        if bucket is None:
+            bucket = TokenBucket(rate / 60, burst)
+            buckets.put(user_id, bucket)
+        return bucket
+
+    # Admit one plan for a user, taking a concurrency slot; call release() once the plan has run
+    # Raises TooManyRequests (429, with retry_after) if the user, the site or the workers are at their limit
+    def admit(self, user_id, api=False):
+        with self._lock:
+            if self.max_concurrent and self._active >= self.max_concurrent:
+                self._refuse('busy', self.busy_retry_after)
+
+            now = time.monotonic()
+            if api:
+                buckets = [('api_rate', self._bucket(self._api_buckets, user_id, self.api_rate, self.api_burst))]
+            else:
+                if self._global_bucket is None:
+                    self._global_bucket = TokenBucket(self.global_rate / 60, self.global_burst)
+                buckets = [('user_rate', self._bucket(self._user_buckets, user_id, self.user_rate, self.user_burst)),
+                           ('global_rate', self._global_bucket)]
+
+            # Only take tokens when every bucket can pay, so a refused request costs nothing
+            for reason, bucket in buckets:
+                wait = bucket.wait_time(1, now)
+                if wait:
+                    self._refuse(reason, wait)
+            for reason, bucket in buckets:
+                bucket.tokens -= 1
+            self._active += 1
+        planning_admissions.inc(result='admitted')
+
+    def release(self):
+        with self._lock:
+            self._active = max(0, self._active - 1)
+
+
+# Process-wide admission control for planning requests (configured in create_app)
+admission = AdmissionControl()
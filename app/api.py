@@ -0,0 +1,289 @@
+import json
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from flask import Blueprint, Response, current_app, jsonify, request, stream_with_context
+from flask_login import current_user
+from werkzeug.exceptions import TooManyRequests
+from app import db
+from app.activities import ACTIVITY_COLS
+from app.admission import admission
+from app.catalog import city_catalogs, get_catalog
+from app.models import POI, Itinerary
+from app import editing
+
+# JSON API for partner integrations
+api = Blueprint('api', __name__, url_prefix='/api')
+
+# Thread pool shared by all API requests in this worker (created on first use, after gunicorn forks), and one
+# permit per pool thread: a plan is only submitted once it has a thread, so every submitted plan is running
+_executor = None
+_executor_slots = None
+_executor_lock = threading.Lock()
+
+def _get_executor():
+    global _executor, _executor_slots
+    with _executor_lock:
+        if _executor is None:
+            workers = current_app.config.get('API_WORKERS', 4)
+            _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='api-planner')
+            _executor_slots = threading.BoundedSemaphore(workers)
+        return _executor, _executor_slots
+
+# API clients use a session cookie or an API key (Authorization: Bearer <key>); answer 401 instead of redirecting
+@api.before_request
+def require_login():
+    if not current_user.is_authenticated:
+        return jsonify(error='Authentication required'), 401
+
+# Validate one planning request and fill in defaults; raises ValueError with a message for the client
+def parse_planning_request(data):
+    if not isinstance(data, dict):
+        raise ValueError('Each request must be a JSON object')
+
+    activities = data.get('activities')
+    if not isinstance(activities, list) or not activities:
+        raise ValueError('activities must be a non-empty list')
+    unknown = [activity for activity in activities if activity not in ACTIVITY_COLS]
+    if unknown:
+        raise ValueError('Unknown activities: %s' % ', '.join(map(str, unknown)))
+
+    days, pois_per_day = data.get('days'), data.get('pois_per_day', 5)
+    for name, value in (('days', days), ('pois_per_day', pois_per_day)):
+        if isinstance(value, bool) or not isinstance(value, int) or value < 1:
+            raise ValueError('%s must be a positive integer' % name)
+    admission.check_bounds(days, pois_per_day)
+
+    city = data.get('city') or city_catalogs.default_city
+    if not isinstance(city, str):
+        raise ValueError('city must be a string')
+    if city not in city_catalogs.cities():
+        raise ValueError('Unknown city: %s' % city)
+
+    return {'city': city, 'activities': sorted(set(activities)), 'days': days, 'pois_per_day': pois_per_day}
+
+# Run one (deduplicated) planning request on a pool thread
+def _plan(params):
+    from app.Itinerary import plan_itineraries  # Planning engine is loaded on first use
+    catalog = get_catalog(params['city'])
+    return plan_itineraries(catalog, params['activities'], params['days'], params['pois_per_day'])
+
+# Give back a plan's pool thread and concurrency slot
+def _release_plan():
+    admission.release()
+    _executor_slots.release()
+
+# Free the slots in the pool thread, before the result is handed back, so the next plan can start at once
+def _run_plan(params):
+    try:
+        return _plan(params)
+    finally:
+        _release_plan()
+
+def _release_if_cancelled(future):
+    if future.cancelled():
+        _release_plan()  # Never ran, so _run_plan did not free its slots
+
+# Plan itineraries for one or many requests
+# Body: a request object, a list of them, or {"requests": [...]}; each request has activities, days,
+# and optionally pois_per_day (default 5) and city (default DEFAULT_CITY).
+# Identical requests are planned once. The response is NDJSON: one line per input request, in completion
+# order, with its "index" in the batch and either "itineraries" or "error".
+# Each plan is admitted as the stream proceeds and costs one token of the caller's API rate (PLAN_API_RATE).
+# If the first plan cannot be admitted the call is answered with 429 and Retry-After; if the limit is reached
+# later on, the plans not started yet are answered with "error", "status": 429 and "retry_after" (seconds).
+@api.route('/itineraries', methods=['POST'])
+def plan_itineraries_batch():
+    body = request.get_json(silent=True)
+    if isinstance(body, dict) and 'requests' in body:
+        body = body['requests']
+    batch = body if isinstance(body, list) else [body]
+    if body is None or not batch:
+        return jsonify(error='Expected a planning request or a list of them'), 400
+
+    max_batch = current_app.config.get('API_MAX_BATCH', 1000)
+    if len(batch) > max_batch:
+        return jsonify(error='At most %d requests per call' % max_batch), 413
+
+    # Group input positions by normalized request, so duplicates share one pipeline run
+    errors, pending = [], {}
+    for index, data in enumerate(batch):
+        try:
+            params = parse_planning_request(data)
+        except ValueError as e:
+            errors.append({'index': index, 'error': str(e)})
+            continue
+        key = json.dumps(params, sort_keys=True)
+        pending.setdefault(key, (params, []))[1].append(index)
+
+    executor, slots = _get_executor()
+    user_id = current_user.id
+    waiting, futures = list(pending.values()), {}
+    logger = current_app.logger
+
+    # Start the next plan once it has a pool thread, a concurrency slot and an API token
+    # Returns False if no thread is free (without blocking); raises TooManyRequests if it is not admitted
+    def start_next(blocking):
+        if not slots.acquire(blocking=blocking):
+            return False
+        try:
+            admission.admit(user_id, api=True)
+        except TooManyRequests:
+            slots.release()
+            raise
+        params, indexes = waiting.pop(0)
+        future = executor.submit(_run_plan, params)
+        future.add_done_callback(_release_if_cancelled)
+        futures[future] = (params, indexes)
+        return True
+
+    if waiting:
+        try:
+            start_next(blocking=True)
+        except TooManyRequests as e:
+            return jsonify(error=e.description), 429, {'Retry-After': str(e.retry_after)}
+
+    def generate():
+        try:
+            for error in errors:
+                yield json.dumps(error) + '\n'
+            while futures:
+                # Keep as many plans running as threads and limits allow; a refusal is retried once one of
+                # this batch's plans has finished
+                try:
+                    while waiting and start_next(blocking=False):
+                        pass
+                except TooManyRequests:
+                    pass
+
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    params, indexes = futures.pop(future)
+                    try:
+                        line = {'request': params, 'itineraries': future.result()}
+                    except Exception as e:
+                        logger.warning('API planning request %s failed: %s', params, e)
+                        line = {'request': params, 'error': str(e)}
+                    for index in indexes:
+                        yield json.dumps(dict(line, index=index)) + '\n'
+
+                # Nothing of this batch is running any more: wait for a free thread, or give up on the rest
+                if waiting and not futures:
+                    try:
+                        start_next(blocking=True)
+                    except TooManyRequests as e:
+                        for params, indexes in waiting:
+                            line = {'request': params, 'error': e.description, 'status': 429, 'retry_after': e.retry_after}
+                            for index in indexes:
+                                yield json.dumps(dict(line, index=index)) + '\n'
+                        del waiting[:]
+        finally:
+            # The client went away (or we are done): drop plans that have not started yet
+            for future in futures:
+                future.cancel()
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+# Editing saved itineraries
+# Every edit answers with the edited day's POIs in their new visiting order:
+# {"itinerary_id": ..., "day": ..., "pois": [{"id", "name", "address", "latitude", "longitude", "position", "pinned"}, ...]}
+def _poi_json(poi):
+    return {'id': poi.id, 'name': poi.name, 'address': poi.address, 'latitude': poi.latitude,
+            'longitude': poi.longitude, 'position': poi.position, 'pinned': bool(poi.pinned)}
+
+def _day_json(itinerary, day, stops):
+    return {'itinerary_id': itinerary.id, 'day': day, 'pois': [_poi_json(stop) for stop in stops]}
+
+def _own_itinerary(itinerary_id):
+    itinerary = db.session.get(Itinerary, itinerary_id)
+    if itinerary is None or itinerary.user_id != current_user.id:
+        return None
+    return itinerary
+
+def _own_poi(itinerary, poi_id):
+    poi = db.session.get(POI, poi_id)
+    return poi if poi is not None and poi.itinerary_id == itinerary.id else None
+
+# Run an edit; invalid input is answered with 400 and nothing is saved
+def _edit(itinerary, edit, *args, **kwargs):
+    try:
+        day, stops = edit(itinerary, *args, **kwargs)
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify(error=str(e)), 400
+    return jsonify(_day_json(itinerary, day, stops))
+
+# A saved itinerary, day by day
+@api.route('/itineraries/<int:itinerary_id>', methods=['GET'])
+def get_itinerary(itinerary_id):
+    itinerary = _own_itinerary(itinerary_id)
+    if itinerary is None:
+        return jsonify(error='Itinerary not found'), 404
+    days = {}
+    for poi in itinerary.pois:
+        days.setdefault(poi.day, []).append(_poi_json(poi))
+    return jsonify(id=itinerary.id, name=itinerary.name, city=itinerary.city or city_catalogs.default_city,
+                   days=[{'day': day, 'pois': pois} for day, pois in sorted(days.items())])
+
+# Add a POI from the itinerary's city to a day. Body: {"name": ..., "day": ...}
+@api.route('/itineraries/<int:itinerary_id>/pois', methods=['POST'])
+def add_itinerary_poi(itinerary_id):
+    itinerary = _own_itinerary(itinerary_id)
+    if itinerary is None:
+        return jsonify(error='Itinerary not found'), 404
+    data = request.get_json(silent=True) or {}
+    return _edit(itinerary, editing.add_poi, data.get('name'), data.get('day'))
+
+# Swap, pin/unpin or move a POI. Body: any of {"name": <replacement POI>, "pinned": bool, "position": int}
+@api.route('/itineraries/<int:itinerary_id>/pois/<int:poi_id>', methods=['PATCH'])
+def update_itinerary_poi(itinerary_id, poi_id):
+    itinerary = _own_itinerary(itinerary_id)
+    poi = itinerary and _own_poi(itinerary, poi_id)
+    if not poi:
+        return jsonify(error='POI not found'), 404
+    data = request.get_json(silent=True) or {}
+    return _edit(itinerary, editing.update_poi, poi, name=data.get('name'), pinned=data.get('pinned'),
+                 position=data.get('position'))
+
+# Remove a POI from its day
+@api.route('/itineraries/<int:itinerary_id>/pois/<int:poi_id>', methods=['DELETE'])
+def remove_itinerary_poi(itinerary_id, poi_id):
+    itinerary = _own_itinerary(itinerary_id)
+    poi = itinerary and _own_poi(itinerary, poi_id)
+    if not poi:
+        return jsonify(error='POI not found'), 404
+    return _edit(itinerary, editing.remove_poi, poi)
+
+# Nearby alternatives to a POI: the closest POIs sharing one of its activities, from precomputed lists
+def _alternatives(city, name, exclude=()):
+    catalog = get_catalog(city)
+    row = catalog.find(name) if isinstance(name, str) else None
+    if row is None:
+        return jsonify(error='Unknown POI: %s' % name), 404
+
+    default = current_app.config.get('ALTERNATIVES_COUNT', 5)
+    k = min(max(request.args.get('k', default, type=int), 1), current_app.config.get('ALTERNATIVES_MAX', 20))
+    rows, distances = catalog.nearby_index.nearby(row, k, exclude)
+    alternatives = []
+    for alternative, record, distance_km in zip(rows, catalog.records(rows), distances):
+        alternatives.append({'name': record['name'], 'address': record['address'], 'latitude': record['Latitude'],
+                             'longitude': record['Longitude'], 'distance_km': round(float(distance_km), 3),
+                             'activities': catalog.activities(alternative)})
+    return jsonify(poi=name, alternatives=alternatives)
+
+# Alternatives to any catalog POI (e.g. one in a generated, not yet saved itinerary). Query: name, city, k
+@api.route('/alternatives', methods=['GET'])
+def poi_alternatives():
+    city = request.args.get('city') or city_catalogs.default_city
+    if city not in city_catalogs.cities():
+        return jsonify(error='Unknown city: %s' % city), 400
+    return _alternatives(city, request.args.get('name'))
+
+# Alternatives to a POI of a saved itinerary, leaving out POIs the itinerary already visits. Query: k
+@api.route('/itineraries/<int:itinerary_id>/pois/<int:poi_id>/alternatives', methods=['GET'])
+def itinerary_poi_alternatives(itinerary_id, poi_id):
+    itinerary = _own_itinerary(itinerary_id)
+    poi = itinerary and _own_poi(itinerary, poi_id)
+    if not poi:
+        return jsonify(error='POI not found'), 404
+    visited = {name for name, in db.session.query(POI.name).filter(POI.itinerary_id == itinerary.id)}
+    return _alternatives(itinerary.city, poi.name, exclude=visited)
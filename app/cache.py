@@ -0,0 +1,187 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+import numpy as np
+
+# Thread-safe, size-bounded LRU cache with hit/miss counters
+class LRUCache:
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)  # Mark as most recently used
+            self.hits += 1
+            return value
+
+    # Look up an entry without counting a hit/miss or changing its recency
+    def peek(self, key):
+        with self._lock:
+            return self._entries.get(key)
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            # Evict the least recently used entries once over capacity
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries), 'maxsize': self.maxsize}
+
+
+# Clustering output for one (dataset version, activity set, days) combination
+class ClusterResult:
+    def __init__(self, rows, labels, centers):
+        self.rows = rows            # Catalog rows that matched the activity filter
+        self.labels = labels        # Cluster assigned to each of those rows
+        self.centers = centers      # Cluster centers (same feature space as the catalog)
+        self.representatives = {}   # pois_per_day -> select_representative_pois output (read-only)
+
+
+# LRU cache of clustering results, optionally persisted as .npz files on disk
+class ClusterCache(LRUCache):
+    def __init__(self, maxsize=256, cache_dir=None):
+        super().__init__(maxsize)
+        self.cache_dir = cache_dir
+
+    # Configure the cache from the app settings (same pattern as the Flask extensions)
+    def init_app(self, app):
+        self.maxsize = app.config.get('CLUSTER_CACHE_SIZE', self.maxsize)
+        self.cache_dir = app.config.get('CLUSTER_CACHE_DIR', self.cache_dir)
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+    # Build the cache key from the dataset version, the activity set, the number of days
+    # and the clustering backend settings
+    @staticmethod
+    def make_key(version, selected_activities, days, signature=()):
+        return (version, tuple(sorted(set(selected_activities))), days, tuple(signature))
+
+    def _disk_path(self, key):
+        from sklearn import __version__ as sklearn_version
+        # Results depend on the scikit-learn version, so it is part of the file name
+        digest = hashlib.sha1(repr((sklearn_version,) + key).encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, digest + '.npz')
+
+    def get(self, key):
+        result = super().get(key)
+        if result is None and self.cache_dir:
+            path = self._disk_path(key)
+            if os.path.exists(path):
+                with np.load(path, allow_pickle=False) as data:
+                    result = ClusterResult(data['rows'], data['labels'], data['centers'])
+                # Promote to memory; counted as a hit since KMeans was skipped
+                LRUCache.put(self, key, result)
+                with self._lock:
+                    self.misses -= 1
+                    self.hits += 1
+        return result
+
+    def put(self, key, result):
+        super().put(key, result)
+        if self.cache_dir:
+            path = self._disk_path(key)
+            tmp_path = '%s.%d.%d.tmp' % (path, os.getpid(), threading.get_ident())
+            with open(tmp_path, 'wb') as f:
+                np.savez(f, rows=result.rows, labels=result.labels, centers=result.centers)
+            os.replace(tmp_path, path)  # Atomic, so readers never see a partial file
+
+
+# Process-wide clustering cache (configured in create_app)
+cluster_cache = ClusterCache()
+
+
+# Rendered itinerary map HTML, keyed by itinerary ID and validated against a content fingerprint
+# Entries can also be stored as files on disk so they survive restarts and are shared between workers
+class MapCache(LRUCache):
+    def __init__(self, maxsize=128, cache_dir=None):
+        super().__init__(maxsize)
+        self.cache_dir = cache_dir
+
+    # Configure the cache from the app settings (same pattern as the Flask extensions)
+    def init_app(self, app):
+        self.maxsize = app.config.get('MAP_CACHE_SIZE', self.maxsize)
+        self.cache_dir = app.config.get('MAP_CACHE_DIR', self.cache_dir)
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+    # One directory per itinerary, one file per rendered version
+    def _disk_dir(self, itinerary_id):
+        return os.path.join(self.cache_dir, str(itinerary_id))
+
+    def _disk_path(self, itinerary_id, etag):
+        return os.path.join(self._disk_dir(itinerary_id), etag + '.html')
+
+    # Return (html, rendered_at) for the itinerary, or None if missing or rendered from older content
+    def get(self, itinerary_id, etag):
+        entry = super().get(itinerary_id)
+        if entry is not None:
+            if entry[0] == etag:
+                return entry[1:]
+            with self._lock:
+                # Rendered from older content: count it as a miss
+                self.hits -= 1
+                self.misses += 1
+        if self.cache_dir:
+            path = self._disk_path(itinerary_id, etag)
+            if os.path.exists(path):
+                with open(path, encoding='utf-8') as f:
+                    html = f.read()
+                rendered_at = datetime.fromtimestamp(int(os.path.getmtime(path)), timezone.utc)
+                LRUCache.put(self, itinerary_id, (etag, html, rendered_at))
+                with self._lock:
+                    self.misses -= 1
+                    self.hits += 1
+                return html, rendered_at
+        return None
+
+    def put(self, itinerary_id, etag, html):
+        rendered_at = datetime.now(timezone.utc).replace(microsecond=0)
+        super().put(itinerary_id, (etag, html, rendered_at))
+        if self.cache_dir:
+            self.invalidate_files(itinerary_id)
+            os.makedirs(self._disk_dir(itinerary_id), exist_ok=True)
+            path = self._disk_path(itinerary_id, etag)
+            tmp_path = '%s.%d.%d.tmp' % (path, os.getpid(), threading.get_ident())
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(html)
+            os.replace(tmp_path, path)
+        return rendered_at
+
+    # Drop every stored rendering of an itinerary (call when it is edited or deleted)
+    def invalidate(self, itinerary_id):
+        with self._lock:
+            self._entries.pop(itinerary_id, None)
+        if self.cache_dir:
+            self.invalidate_files(itinerary_id)
+
+    def invalidate_files(self, itinerary_id):
+        directory = self._disk_dir(itinerary_id)
+        if not os.path.isdir(directory):
+            return
+        for name in os.listdir(directory):
+            if name.endswith('.html'):
+                try:
+                    os.remove(os.path.join(directory, name))
+                except FileNotFoundError:
+                    pass  # Already removed by another worker
+
+
+# Process-wide map cache (configured in create_app)
+map_cache = MapCache()
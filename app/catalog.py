@@ -0,0 +1,244 @@
+import logging
+import os
+import threading
+from functools import cached_property
+import numpy as np
+from app.activities import ACTIVITY_COLS
+from app.cache import LRUCache
+from app.poi_store import STORE_SUFFIX, POIStore, file_sha1, store_path
+
+logger = logging.getLogger(__name__)
+
+# Bit assigned to each activity in the packed activity bitmap
+ACTIVITY_BITS = {activity: 1 << i for i, activity in enumerate(ACTIVITY_COLS)}
+
+# Pack a list of activity names into a single bitmask
+def activity_mask(activities):
+    mask = 0
+    for activity in activities:
+        mask |= ACTIVITY_BITS[activity]
+    return np.uint16(mask)
+
+# Scale each column to 0-1 (same arithmetic as MinMaxScaler, without its NaN-aware passes)
+def min_max_scale(values):
+    low, high = values.min(axis=0), values.max(axis=0)
+    span = high - low
+    span[span == 0] = 1  # Constant columns map to 0
+    scale = 1 / span
+    return values * scale - low * scale
+
+# Modification times of a dataset CSV and its compiled store (None if missing); any change triggers a reload
+def dataset_stamp(path):
+    stamps = []
+    for candidate in (path, store_path(path)):
+        try:
+            stamps.append(os.stat(candidate).st_mtime_ns)
+        except FileNotFoundError:
+            stamps.append(None)
+    return tuple(stamps)
+
+# In-memory POI catalog, built once per worker process and shared by every request
+class POICatalog:
+    def __init__(self, path, stamp, version, names, addresses, latitude, longitude, activity_bits):
+        self.path = path        # Dataset file the catalog was built from
+        self.stamp = stamp      # dataset_stamp() at load (used for reloads)
+        self.version = version  # Content hash of the dataset (used in cache keys)
+
+        # Per-POI columns (row i of every array is the same POI)
+        self.names = names                  # Sequence of names (list, or interned strings from the store)
+        self.addresses = addresses          # Sequence of addresses ('' when unknown)
+        self.latitude = latitude            # Original coordinates (float64)
+        self.longitude = longitude
+        self.activity_bits = activity_bits  # Activity bitmap: one packed uint16 per POI (bit i = ACTIVITY_COLS[i])
+
+        # Normalized coordinates (0-1) for clustering and the spatial index
+        self.coords = min_max_scale(np.column_stack([latitude, longitude]))
+
+    def __len__(self):
+        return len(self.latitude)
+
+    # Posting lists: sorted row indices of the POIs tagged with each activity (built on first use)
+    @cached_property
+    def postings(self):
+        return {activity: np.flatnonzero(self.activity_bits & bit) for activity, bit in ACTIVITY_BITS.items()}
+
+    # Clustering features: normalized coordinates followed by the 0/1 activity flags (built on first use)
+    @cached_property
+    def features(self):
+        features = np.empty((len(self), 2 + len(ACTIVITY_COLS)))
+        features[:, :2] = self.coords
+        weights = np.array([ACTIVITY_BITS[activity] for activity in ACTIVITY_COLS], dtype=np.uint16)
+        features[:, 2:] = (self.activity_bits[:, None] & weights) > 0
+        return features
+
+    # KD-tree over the normalized coordinates (built on first use)
+    @cached_property
+    def spatial_index(self):
+        from app.spatial import SpatialIndex  # SciPy is only imported once a route needs the index
+        return SpatialIndex(self.coords)
+
+    # Nearby alternatives for each POI (precomputed lists from python -m app.neighbors, built on first use)
+    @cached_property
+    def nearby_index(self):
+        from app.neighbors import NearbyIndex
+        return NearbyIndex.for_catalog(self)
+
+    # Activities a POI is tagged with
+    def activities(self, row):
+        bits = int(self.activity_bits[row])
+        return [activity for activity, bit in ACTIVITY_BITS.items() if bits & bit]
+
+    # Row of the first POI with each name (built on first use, for looking POIs up by name)
+    @cached_property
+    def name_index(self):
+        index = {}
+        for row in range(len(self)):
+            index.setdefault(self.names[row], row)
+        return index
+
+    # Row of the POI with this name (None if the catalog has none)
+    def find(self, name):
+        return self.name_index.get(name)
+
+    # Row indices of POIs tagged with any of the given activities
+    def match_activities(self, activities):
+        if len(activities) == 1:
+            return self.postings[activities[0]]
+        return np.flatnonzero(self.activity_bits & activity_mask(activities))
+
+    # Convert catalog rows to plain dicts (one per POI, same keys as the prepared dataset columns)
+    def records(self, rows):
+        records = []
+        for row in rows:
+            bits = int(self.activity_bits[row])
+            latitude, longitude = float(self.latitude[row]), float(self.longitude[row])
+            record = {'name': self.names[row], 'address': self.addresses[row]}
+            record.update((activity, 1.0 if bits & bit else 0.0) for activity, bit in ACTIVITY_BITS.items())
+            record.update({
+                'Latitude': latitude,
+                'Longitude': longitude,
+                'Original_Latitude': latitude,
+                'Original_Longitude': longitude,
+                'Norm_Latitude': float(self.coords[row, 0]),
+                'Norm_Longitude': float(self.coords[row, 1]),
+            })
+            records.append(record)
+        return records
+
+    # Build a catalog by parsing a CSV dataset
+    @classmethod
+    def from_csv(cls, path):
+        from app.Itinerary import load_poi_data  # pandas is only imported when a CSV has to be parsed
+        stamp = dataset_stamp(path)
+        df = load_poi_data(path)
+        weights = np.array([ACTIVITY_BITS[activity] for activity in ACTIVITY_COLS], dtype=np.uint16)
+        return cls(path, stamp, file_sha1(path),
+                   names=df['name'].astype(str).tolist(),
+                   addresses=df['address'].fillna('').astype(str).tolist(),
+                   latitude=df['Original_Latitude'].to_numpy(dtype=np.float64),
+                   longitude=df['Original_Longitude'].to_numpy(dtype=np.float64),
+                   activity_bits=((df[ACTIVITY_COLS].to_numpy() > 0) * weights).sum(axis=1, dtype=np.uint16))
+
+    # Build a catalog from a memory-mapped store (no parsing; strings are decoded on demand)
+    @classmethod
+    def from_store(cls, path, store):
+        latitude, longitude = store.coordinates()
+        return cls(path, dataset_stamp(path), store.version, store.names, store.addresses,
+                   latitude, longitude, store.activity_bits)
+
+    # Load a dataset, preferring its compiled store (python -m app.poi_store) when it is up to date
+    @classmethod
+    def load(cls, path):
+        compiled = store_path(path)
+        if os.path.exists(compiled):
+            try:
+                store = POIStore.open(compiled, ACTIVITY_COLS)
+                if store.is_fresh_for(path):
+                    return cls.from_store(path, store)
+                logger.warning('%s is older than %s; parsing the CSV (rebuild with python -m app.poi_store)', compiled, path)
+            except ValueError as e:
+                logger.warning('Ignoring POI store: %s', e)
+        return cls.from_csv(path)
+
+
+# Directory holding one POI dataset per city (relative to the project root)
+DATASET_DIR = 'dataset'
+
+# City a dataset file belongs to (datasets are named <City>_<anything>.csv, e.g. London_cleaned_with_all_pois.csv)
+def city_name(path):
+    return os.path.basename(path).split('_', 1)[0]
+
+# Find the city datasets in a directory: city -> CSV path
+# A compiled store without its CSV also counts (the CSV does not need to be deployed)
+def discover_cities(dataset_dir):
+    cities = {}
+    for filename in sorted(os.listdir(dataset_dir)):
+        stem, ext = os.path.splitext(filename)
+        if ext not in ('.csv', STORE_SUFFIX) or '_' not in stem:
+            continue
+        path = os.path.join(dataset_dir, stem + '.csv')
+        previous = cities.setdefault(city_name(path), path)
+        if previous != path:
+            logger.warning('Several datasets for %s in %s; using %s', city_name(path), dataset_dir, previous)
+    return cities
+
+# Per-city POI catalogs, loaded on first request and evicted least-recently-used first
+# Each catalog keeps its own normalization, activity bitmaps and spatial index
+class CatalogRegistry:
+    def __init__(self, dataset_dir=None, default_city=None, max_cities=8):
+        self.dataset_dir = dataset_dir
+        self.default_city = default_city
+        self._loaded = LRUCache(max_cities)  # city -> POICatalog
+        self._scan = (None, {})              # (directory mtime, discover_cities() result)
+        self._load_locks = {}
+        self._lock = threading.Lock()
+
+    # Configure the registry from the app settings (same pattern as the Flask extensions)
+    def init_app(self, app):
+        default_path = app.config['POI_DATASET_PATH']
+        self.dataset_dir = app.config.get('CITY_DATASET_DIR') or os.path.dirname(default_path)
+        self.default_city = app.config.get('DEFAULT_CITY') or city_name(default_path)
+        self._loaded.maxsize = app.config.get('MAX_LOADED_CITIES', self._loaded.maxsize)
+
+    # Available cities (city -> dataset path); the directory is rescanned when its contents change
+    def cities(self):
+        mtime = os.stat(self.dataset_dir).st_mtime_ns
+        scanned_at, cities = self._scan
+        if scanned_at != mtime:
+            cities = discover_cities(self.dataset_dir)
+            self._scan = (mtime, cities)
+        return cities
+
+    # One lock per city, so loading a cold city does not hold up requests for the others
+    def _load_lock(self, city):
+        with self._lock:
+            return self._load_locks.setdefault(city, threading.Lock())
+
+    # Return a city's catalog, loading it (or reloading it if its dataset changed on disk) as needed
+    def get(self, city=None):
+        city = city or self.default_city
+        path = self.cities().get(city)
+        if path is None:
+            raise ValueError('Unknown city: %s' % city)
+
+        stamp = dataset_stamp(path)
+        catalog = self._loaded.get(city)
+        if catalog is None or catalog.stamp != stamp:
+            with self._load_lock(city):
+                # Another thread may have loaded it while we waited for the lock
+                catalog = self._loaded.peek(city)
+                if catalog is None or catalog.stamp != stamp:
+                    catalog = POICatalog.load(path)
+                    self._loaded.put(city, catalog)
+        return catalog
+
+    def stats(self):
+        return self._loaded.stats()
+
+
+# Process-wide city catalogs (configured in create_app)
+city_catalogs = CatalogRegistry()
+
+# Return the catalog for a city (the default city if none is given)
+def get_catalog(city=None):
+    return city_catalogs.get(city)
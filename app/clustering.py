@@ -0,0 +1,110 @@
+import numpy as np
+from app.cache import LRUCache
+
+# Clustering algorithms; 'auto' picks one from the number of POIs being clustered
+ALGORITHMS = ('auto', 'kmeans', 'minibatch')
+
+# Fixed seed so the same request always produces the same clusters (and can be cached)
+RANDOM_STATE = 42
+
+# Clustering backend used by apply_kmeans
+# Small selections get full-batch KMeans; large ones get MiniBatchKMeans, warm-started from a
+# partition of the whole catalog that is computed once per dataset version
+class ClusteringBackend:
+    def __init__(self, algorithm='auto', n_init='auto', max_iter=300, minibatch_threshold=150000,
+                 batch_size=4096, minibatch_tol=1e-3, warm_start=True, reference_clusters=64, reference_sample=100000):
+        self.algorithm = algorithm                      # 'auto', 'kmeans' or 'minibatch'
+        self.n_init = n_init                            # KMeans restarts ('auto' = scikit-learn default)
+        self.max_iter = max_iter                        # Iteration (or MiniBatch epoch) budget per run
+        self.minibatch_threshold = minibatch_threshold  # POIs to cluster from which 'auto' uses MiniBatchKMeans
+        self.batch_size = batch_size                    # MiniBatchKMeans batch size
+        self.minibatch_tol = minibatch_tol              # MiniBatchKMeans stops once centers move less than this
+        self.warm_start = warm_start                    # Seed MiniBatchKMeans from the reference partition
+        self.reference_clusters = reference_clusters    # Clusters in the reference partition of the whole catalog
+        self.reference_sample = reference_sample        # Catalog rows sampled to fit the reference partition
+        self._references = LRUCache(maxsize=8)          # (dataset version, settings) -> reference labels
+
+    # Configure the backend from the app settings (same pattern as the Flask extensions)
+    def init_app(self, app):
+        self.algorithm = app.config.get('CLUSTERING_ALGORITHM', self.algorithm)
+        if self.algorithm not in ALGORITHMS:
+            raise ValueError('CLUSTERING_ALGORITHM must be one of %s, not %r' % (', '.join(ALGORITHMS), self.algorithm))
+        self.n_init = app.config.get('CLUSTERING_N_INIT', self.n_init)
+        self.max_iter = app.config.get('CLUSTERING_MAX_ITER', self.max_iter)
+        self.minibatch_threshold = app.config.get('CLUSTERING_MINIBATCH_THRESHOLD', self.minibatch_threshold)
+        self.batch_size = app.config.get('CLUSTERING_BATCH_SIZE', self.batch_size)
+        self.minibatch_tol = app.config.get('CLUSTERING_MINIBATCH_TOL', self.minibatch_tol)
+        self.warm_start = app.config.get('CLUSTERING_WARM_START', self.warm_start)
+        self.reference_clusters = app.config.get('CLUSTERING_REFERENCE_CLUSTERS', self.reference_clusters)
+        self.reference_sample = app.config.get('CLUSTERING_REFERENCE_SAMPLE', self.reference_sample)
+
+    # Algorithm used to cluster this many POIs
+    # MiniBatchKMeans only pays off on large selections: below the threshold full KMeans is both faster and
+    # at least as accurate (see benchmarks/bench_pipeline.py --algorithms kmeans minibatch)
+    def algorithm_for(self, n_rows):
+        if self.algorithm != 'auto':
+            return self.algorithm
+        return 'minibatch' if n_rows >= self.minibatch_threshold else 'kmeans'
+
+    # Whether any request on this catalog can use MiniBatchKMeans (and so its reference partition)
+    def uses_minibatch(self, catalog):
+        return self.algorithm_for(len(catalog)) == 'minibatch'
+
+    # Settings that change the clustering (part of the cluster cache key)
+    # The algorithm itself follows from the POIs being clustered, which the rest of the key already fixes
+    def signature(self):
+        return (self.algorithm, self.minibatch_threshold, self.n_init, self.max_iter, self.batch_size, self.minibatch_tol,
+                (self.reference_clusters, self.reference_sample) if self.warm_start else None)
+
+    # Reference cluster of every catalog row (cached per dataset version)
+    # MiniBatchKMeans is fitted on a fixed random sample of the unfiltered catalog, then every row is assigned
+    def reference_labels(self, catalog):
+        key = (catalog.version, self.reference_clusters, self.reference_sample, self.batch_size)
+        labels = self._references.get(key)
+        if labels is None:
+            from sklearn.cluster import MiniBatchKMeans
+            features = catalog.features
+            if len(features) > self.reference_sample:
+                rng = np.random.default_rng(RANDOM_STATE)
+                features = features[np.sort(rng.choice(len(features), self.reference_sample, replace=False))]
+            model = MiniBatchKMeans(n_clusters=min(self.reference_clusters, len(features)), batch_size=self.batch_size,
+                                    n_init=1, random_state=RANDOM_STATE).fit(features)
+            labels = model.predict(catalog.features)
+            self._references.put(key, labels)
+        return labels
+
+    # Starting centers for clustering `rows` into `days` clusters (None if there is too little to seed from)
+    # Each reference cluster is summarized by the mean of its filtered rows, and a weighted KMeans over
+    # those few summaries picks the centers, so the full run starts close to its final answer
+    def initial_centers(self, catalog, rows, days):
+        groups = self.reference_labels(catalog)[rows]
+        counts = np.bincount(groups)
+        occupied = np.flatnonzero(counts)
+        if len(occupied) < days:
+            return None
+
+        X = catalog.features[rows]
+        means = np.column_stack([np.bincount(groups, weights=X[:, d], minlength=len(counts))
+                                 for d in range(X.shape[1])])[occupied] / counts[occupied, None]
+        from sklearn.cluster import KMeans
+        seed = KMeans(n_clusters=days, n_init=1, random_state=RANDOM_STATE)
+        seed.fit(means, sample_weight=counts[occupied])
+        return seed.cluster_centers_
+
+    # Cluster the given catalog rows into `days` clusters; returns (labels, fitted model)
+    # (scikit-learn is imported on the first fit, not when the app starts)
+    def fit(self, catalog, rows, days):
+        from sklearn.cluster import KMeans, MiniBatchKMeans
+        X = catalog.features[rows]
+        if self.algorithm_for(len(rows)) == 'kmeans':
+            model = KMeans(n_clusters=days, n_init=self.n_init, max_iter=self.max_iter, random_state=RANDOM_STATE)
+        else:
+            init = self.initial_centers(catalog, rows, days) if self.warm_start else None
+            model = MiniBatchKMeans(n_clusters=days, init='k-means++' if init is None else init,
+                                    n_init=self.n_init if init is None else 1, max_iter=self.max_iter,
+                                    batch_size=self.batch_size, tol=self.minibatch_tol, random_state=RANDOM_STATE)
+        labels = model.fit_predict(X)
+        return labels, model
+
+
+clustering_backend = ClusteringBackend()
@@ -0,0 +1,56 @@
+import os
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+# Database URL: DATABASE_URL from the environment (e.g. a managed PostgreSQL) overrides SQLALCHEMY_DATABASE_URI
+def database_uri(app):
+    uri = os.environ.get('DATABASE_URL') or app.config['SQLALCHEMY_DATABASE_URI']
+    if uri.startswith('postgres://'):
+        uri = 'postgresql://' + uri[len('postgres://'):]  # Heroku-style URLs use a scheme SQLAlchemy no longer accepts
+    return uri
+
+# Engine options for the configured backend
+# SQLite: wait for the write lock instead of failing at once ("database is locked");
+# other servers: a bounded connection pool that drops dead connections before handing them out
+def engine_options(app, uri):
+    config = app.config
+    options = dict(config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+    if make_url(uri).get_backend_name() == 'sqlite':
+        connect_args = options.setdefault('connect_args', {})
+        connect_args.setdefault('timeout', config.get('SQLITE_BUSY_TIMEOUT', 30))
+        connect_args.setdefault('check_same_thread', False)  # Connections move between request and planner threads via the pool
+    else:
+        options.setdefault('pool_size', config.get('DATABASE_POOL_SIZE', 5))
+        options.setdefault('max_overflow', config.get('DATABASE_MAX_OVERFLOW', 10))
+        options.setdefault('pool_timeout', config.get('DATABASE_POOL_TIMEOUT', 30))
+        options.setdefault('pool_recycle', config.get('DATABASE_POOL_RECYCLE', 1800))
+        options.setdefault('pool_pre_ping', True)
+    return options
+
+# Pragmas run on every new SQLite connection
+# WAL lets readers carry on while one worker writes, and with synchronous=NORMAL a commit no longer waits for an fsync
+def sqlite_pragmas(config):
+    pragmas = {'busy_timeout': int(config.get('SQLITE_BUSY_TIMEOUT', 30) * 1000)}
+    if config.get('SQLITE_WAL', True):
+        pragmas.update(journal_mode='WAL', synchronous='NORMAL')
+    pragmas.update(config.get('SQLITE_PRAGMAS') or {})
+    return pragmas
+
+# Choose the database and its engine options (called before db.init_app)
+def configure_database(app):
+    uri = database_uri(app)
+    app.config['SQLALCHEMY_DATABASE_URI'] = uri
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app, uri)
+
+# Apply the SQLite pragmas to the app's engine (called after db.init_app, before the first connection)
+def tune_engine(engine, config):
+    if engine.dialect.name != 'sqlite':
+        return
+    pragmas = sqlite_pragmas(config)
+
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute('PRAGMA %s = %s' % (name, value))
+        cursor.close()
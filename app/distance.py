@@ -0,0 +1,50 @@
+import numpy as np
+
+EARTH_RADIUS_KM = 6371  # Earth radius in kilometers
+
+# Convert degrees to radians as an array of the requested float type
+def _radians(values, dtype):
+    return np.radians(np.asarray(values, dtype=dtype))
+
+# Haversine distance (km) between matching points; inputs broadcast like NumPy arrays
+def haversine(lat1, lon1, lat2, lon2, dtype=np.float64):
+    lat1, lon1 = _radians(lat1, dtype), _radians(lon1, dtype)
+    lat2, lon2 = _radians(lat2, dtype), _radians(lon2, dtype)
+
+    a = np.sin((lat2 - lat1) / 2)**2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2)**2
+    return (2 * EARTH_RADIUS_KM) * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+# Equirectangular approximation (km): much cheaper than haversine and accurate at city scale
+def equirectangular(lat1, lon1, lat2, lon2, dtype=np.float64):
+    lat1, lon1 = _radians(lat1, dtype), _radians(lon1, dtype)
+    lat2, lon2 = _radians(lat2, dtype), _radians(lon2, dtype)
+
+    x = (lon2 - lon1) * np.cos((lat1 + lat2) / 2)
+    y = lat2 - lat1
+    return EARTH_RADIUS_KM * np.sqrt(x * x + y * y)
+
+# Available distance formulas
+METHODS = {'haversine': haversine, 'equirectangular': equirectangular}
+
+# Distances (km) from one point to many points
+def one_to_many(lat, lon, lats, lons, method='haversine', dtype=np.float64):
+    return METHODS[method](lat, lon, lats, lons, dtype=dtype)
+
+# Pairwise distance matrix (km) between all the given points
+def pairwise(lats, lons, method='haversine', dtype=np.float64):
+    lats = np.asarray(lats, dtype=dtype)
+    lons = np.asarray(lons, dtype=dtype)
+    return METHODS[method](lats[:, None], lons[:, None], lats[None, :], lons[None, :], dtype=dtype)
+
+# Total length (km) of a path visiting the points in order
+def path_length(lats, lons, method='haversine', dtype=np.float64):
+    lats = np.asarray(lats, dtype=dtype)
+    lons = np.asarray(lons, dtype=dtype)
+    if len(lats) < 2:
+        return 0.0
+    return float(METHODS[method](lats[:-1], lons[:-1], lats[1:], lons[1:], dtype=dtype).sum())
+
+# Squared Euclidean distances from many points to one point (e.g. to a cluster center in normalized space)
+def squared_euclidean_to_point(points, point):
+    diff = np.asarray(points) - np.asarray(point)
+    return np.einsum('ij,ij->i', diff, diff)
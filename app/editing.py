@@ -0,0 +1,91 @@
+import numpy as np
+from sqlalchemy import func
+from app import db
+from app.cache import map_cache
+from app.catalog import get_catalog
+from app.metrics import timed
+from app.models import POI
+
+# Edits to a saved itinerary
+# Each edit touches one day: only that day's POIs are loaded, only that day's route is re-optimized,
+# and only the rows whose values changed are written
+
+# A day's POIs in visiting order
+def day_stops(itinerary_id, day):
+    return POI.query.filter_by(itinerary_id=itinerary_id, day=day).order_by(POI.position, POI.id).all()
+
+# New visiting order for a day: pinned POIs keep their place in the day, the others fill the remaining
+# places in the order of the optimized route through all of the day's POIs
+def reorder_stops(stops):
+    if len(stops) < 3 or any(stop.latitude is None or stop.longitude is None for stop in stops):
+        return list(stops)
+
+    from app.Itinerary import optimize_order, record_route_moves
+    lats = np.array([stop.latitude for stop in stops], dtype=np.float64)
+    lons = np.array([stop.longitude for stop in stops], dtype=np.float64)
+    order, swaps, moves = optimize_order(lats, lons)
+    record_route_moves(swaps, moves)
+
+    route = iter([stops[k] for k in order if not stops[k].pinned])
+    return [stop if stop.pinned else next(route) for stop in stops]
+
+# Re-optimize one day of an itinerary and commit the edit
+# The unit of work only issues UPDATEs for POIs whose position actually changed
+@timed('reoptimize_day')
+def reoptimize_day(itinerary, stops):
+    stops = reorder_stops(stops)
+    for position, stop in enumerate(stops):
+        if stop.position != position:
+            stop.position = position
+    db.session.commit()
+    map_cache.invalidate(itinerary.id)
+    return stops
+
+# Catalog record of the POI with this name in the itinerary's city (raises ValueError if there is none)
+def catalog_poi(itinerary, name):
+    catalog = get_catalog(itinerary.city)
+    row = catalog.find(name) if isinstance(name, str) else None
+    if row is None:
+        raise ValueError('Unknown POI: %s' % name)
+    return catalog.records([row])[0]
+
+# Copy a catalog record's details onto a POI row
+def _assign(poi, record):
+    poi.name = record['name']
+    poi.address = record['address']
+    poi.latitude = poi.original_latitude = record['Original_Latitude']
+    poi.longitude = poi.original_longitude = record['Original_Longitude']
+
+# Add a catalog POI to a day (which may be a new day at the end of the trip)
+def add_poi(itinerary, name, day):
+    last_day = db.session.query(func.max(POI.day)).filter(POI.itinerary_id == itinerary.id).scalar() or 0
+    if isinstance(day, bool) or not isinstance(day, int) or not 1 <= day <= last_day + 1:
+        raise ValueError('day must be between 1 and %d' % (last_day + 1))
+
+    stops = day_stops(itinerary.id, day)
+    poi = POI(itinerary_id=itinerary.id, day=day, position=len(stops), pinned=False)
+    _assign(poi, catalog_poi(itinerary, name))
+    db.session.add(poi)
+    return day, reoptimize_day(itinerary, stops + [poi])
+
+# Remove a POI from its day
+def remove_poi(itinerary, poi):
+    stops = [stop for stop in day_stops(itinerary.id, poi.day) if stop.id != poi.id]
+    db.session.delete(poi)
+    return poi.day, reoptimize_day(itinerary, stops)
+
+# Change a POI: swap it for another catalog POI (name), pin or unpin it (pinned), and/or move it to
+# another place in its day (position, which also pins it so the optimizer keeps it there)
+def update_poi(itinerary, poi, name=None, pinned=None, position=None):
+    stops = day_stops(itinerary.id, poi.day)
+    if name is not None and name != poi.name:
+        _assign(poi, catalog_poi(itinerary, name))
+    if position is not None:
+        if isinstance(position, bool) or not isinstance(position, int) or not 0 <= position < len(stops):
+            raise ValueError('position must be between 0 and %d' % (len(stops) - 1))
+        stops.remove(poi)
+        stops.insert(position, poi)
+        pinned = True if pinned is None else pinned
+    if pinned is not None:
+        poi.pinned = bool(pinned)
+    return poi.day, reoptimize_day(itinerary, stops)
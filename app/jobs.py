@@ -0,0 +1,126 @@
+import json
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from app import db
+from app.models import PlanningJob
+from app.catalog import get_catalog
+
+# Background queue for itinerary generation
+# Job state lives in the database (so any worker process can report it), the work runs on a thread pool
+class JobQueue:
+    def __init__(self, max_workers=2, timeout=300, queue_timeout=1800, draft_ttl=86400, max_drafts=20):
+        self.max_workers = max_workers  # Planner threads per worker process
+        self.timeout = timeout          # Seconds a job may run before it is considered lost
+        self.queue_timeout = queue_timeout  # Seconds a job may wait for a planner thread before it is considered lost
+        self.draft_ttl = draft_ttl      # Seconds a finished job is kept as a draft the user can save
+        self.max_drafts = max_drafts    # Finished jobs kept per user (oldest are deleted first)
+        self.app = None
+        self._executor = None
+        self._lock = threading.Lock()
+
+    # Configure the queue from the app settings (same pattern as the Flask extensions)
+    def init_app(self, app):
+        self.app = app
+        self.max_workers = app.config.get('PLANNING_WORKERS', self.max_workers)
+        self.timeout = app.config.get('PLANNING_JOB_TIMEOUT', self.timeout)
+        self.queue_timeout = app.config.get('PLANNING_QUEUE_TIMEOUT', self.queue_timeout)
+        self.draft_ttl = app.config.get('DRAFT_TTL', self.draft_ttl)
+        self.max_drafts = app.config.get('MAX_DRAFTS_PER_USER', self.max_drafts)
+
+    # Thread pool is created on first use, so it is never started before gunicorn forks its workers
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='planner')
+            return self._executor
+
+    # Queue a planning job and return its ID straight away
+    # on_finish (optional) is called once the job has finished, failed or could not be queued
+    def submit(self, user_id, params, on_finish=None):
+        try:
+            self.prune_drafts(user_id)
+            job_id = uuid.uuid4().hex
+            db.session.add(PlanningJob(id=job_id, user_id=user_id, status='queued', params=json.dumps(params)))
+            db.session.commit()
+            self._get_executor().submit(self._run, job_id, on_finish)
+        except Exception:
+            if on_finish is not None:
+                on_finish()
+            raise
+        return job_id
+
+    # Execute one job inside its own app context (runs on a planner thread)
+    def _run(self, job_id, on_finish=None):
+        try:
+            self._run_job(job_id)
+        finally:
+            if on_finish is not None:
+                on_finish()
+
+    # Status changes are conditional UPDATEs, so a job expired by expire_if_stale is neither started
+    # nor overwritten with a result afterwards
+    def _set_status(self, job_id, expected, **values):
+        updated = (PlanningJob.query.filter(PlanningJob.id == job_id, PlanningJob.status.in_(expected))
+                   .update(values, synchronize_session=False))
+        db.session.commit()
+        return updated == 1
+
+    def _run_job(self, job_id):
+        with self.app.app_context():
+            if not self._set_status(job_id, ['queued'], status='running', date_started=datetime.utcnow()):
+                return  # Expired while it waited for a thread
+            job = db.session.get(PlanningJob, job_id)
+
+            try:
+                from app.Itinerary import plan_itineraries  # Planning engine is loaded on first use (or by the warm-up)
+                params = json.loads(job.params)
+                catalog = get_catalog(params.get('city'))  # Jobs queued before cities existed use the default city
+                itineraries = plan_itineraries(catalog, params['activities'], params['days'])
+                outcome = {'status': 'done', 'result': json.dumps(itineraries)}
+            except Exception as e:
+                db.session.rollback()
+                self.app.logger.exception("Planning job %s failed", job_id)
+                outcome = {'status': 'failed', 'error': str(e)[:255]}
+
+            if not self._set_status(job_id, ['running'], date_finished=datetime.utcnow(), **outcome):
+                self.app.logger.warning("Planning job %s finished after it had expired", job_id)
+
+    # Mark a job as failed if it has been pending for too long (e.g. its worker process was restarted)
+    # Running jobs are timed from when they started, so a job waiting behind others is not failed early
+    def expire_if_stale(self, job):
+        now = datetime.utcnow()
+        if job.status == 'running':
+            stale = (job.date_started or job.date_created) < now - timedelta(seconds=self.timeout)
+        else:
+            stale = job.status == 'queued' and job.date_created < now - timedelta(seconds=self.queue_timeout)
+        if stale:
+            self._set_status(job.id, [job.status], status='failed', date_finished=now,
+                             error='Planning took too long, please try again.')
+            db.session.refresh(job)  # Failed now, or finished by its planner thread in the meantime
+        return job
+
+    # A user's finished job, as a draft they can save (None if it is not theirs, not done or expired)
+    def get_draft(self, user_id, job_id):
+        job = PlanningJob.query.filter_by(id=job_id, user_id=user_id, status='done').first()
+        if job is None or job.date_finished < datetime.utcnow() - timedelta(seconds=self.draft_ttl):
+            return None
+        return job
+
+    # Delete expired jobs (of every user) and the user's finished jobs beyond the newest max_drafts
+    def prune_drafts(self, user_id):
+        cutoff = datetime.utcnow() - timedelta(seconds=self.draft_ttl)
+        PlanningJob.query.filter(PlanningJob.date_finished < cutoff).delete(synchronize_session=False)
+        keep = (db.session.query(PlanningJob.id)
+                .filter(PlanningJob.user_id == user_id, PlanningJob.date_finished.isnot(None))
+                .order_by(PlanningJob.date_finished.desc())
+                .limit(self.max_drafts))
+        (PlanningJob.query
+         .filter(PlanningJob.user_id == user_id, PlanningJob.date_finished.isnot(None), PlanningJob.id.notin_(keep.scalar_subquery()))
+         .delete(synchronize_session=False))
+        db.session.commit()
+
+
+# Process-wide planning queue (configured in create_app)
+planning_queue = JobQueue()
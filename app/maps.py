@@ -0,0 +1,35 @@
+import hashlib
+
+# Bump when the map rendering below changes, so cached maps and browser copies are refreshed
+MAP_RENDER_VERSION = '1'
+
+# Fingerprint of everything that appears on an itinerary's map (used as the ETag and cache key)
+def map_fingerprint(pois):
+    digest = hashlib.sha1(MAP_RENDER_VERSION.encode('utf-8'))
+    for poi in pois:
+        digest.update(repr((poi.id, poi.name, poi.original_latitude, poi.original_longitude)).encode('utf-8'))
+    return digest.hexdigest()
+
+# Build the folium map HTML for a list of POIs (None if no POI has coordinates)
+def render_map_html(pois):
+    # Find the first POI with valid original coordinates
+    first_poi = next((p for p in pois if p.original_latitude and p.original_longitude), None)
+    if not first_poi:
+        return None
+
+    import folium  # For rendering interactive maps (imported on the first render, it is slow to load)
+
+    map_center = [first_poi.original_latitude, first_poi.original_longitude]
+    m = folium.Map(location=map_center, zoom_start=12)
+
+    for poi in pois:
+        if poi.original_latitude is None or poi.original_longitude is None:
+            continue  # Skip POIs with missing coordinates
+
+        folium.Marker(
+            [poi.original_latitude, poi.original_longitude],
+            popup=folium.Popup(poi.name, parse_html=True),
+            icon=folium.Icon(color="blue")
+        ).add_to(m)
+
+    return m._repr_html_()
@@ -0,0 +1,220 @@
+import cProfile
+import os
+import random
+import threading
+import time
+from functools import wraps
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+# Default histogram buckets for durations (seconds) and for counts
+TIME_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+# Format label names and values the way the Prometheus text format expects
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join('%s="%s"' % (name, value) for (name, _), value in zip(pairs, escaped)) + '}'
+
+# Monotonic counter, optionally split by labels
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, '') for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name + _format_labels(self.labels, key), value) for key, value in self._values.items()]
+
+# Histogram with cumulative buckets, optionally split by labels
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=TIME_BUCKETS):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self.buckets = tuple(buckets)
+        self._values = {}  # label values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, '') for name in self.labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            for key, state in self._values.items():
+                for bound, count in zip(self.buckets, state):
+                    samples.append((self.name + '_bucket' + _format_labels(self.labels, key, [('le', bound)]), count))
+                samples.append((self.name + '_bucket' + _format_labels(self.labels, key, [('le', '+Inf')]), state[-1]))
+                samples.append((self.name + '_sum' + _format_labels(self.labels, key), state[-2]))
+                samples.append((self.name + '_count' + _format_labels(self.labels, key), state[-1]))
+        return samples
+
+# Value read from a callback at scrape time (e.g. cache statistics)
+class CallbackMetric:
+    def __init__(self, name, help, kind, labels, callback):
+        self.name, self.help, self.kind, self.labels = name, help, kind, tuple(labels)
+        self.callback = callback  # Returns {label values tuple: value}
+
+    def samples(self):
+        return [(self.name + _format_labels(self.labels, key), value) for key, value in self.callback().items()]
+
+# Collection of metrics for this worker process
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self.register(Counter(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=TIME_BUCKETS):
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def callback(self, name, help, kind, labels, callback):
+        return self.register(CallbackMetric(name, help, kind, labels, callback))
+
+    # Render every metric in the Prometheus text exposition format
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.append('# HELP %s %s' % (metric.name, metric.help))
+            lines.append('# TYPE %s %s' % (metric.name, metric.kind))
+            lines.extend('%s %s' % (name, float(value)) for name, value in metric.samples())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+# Planning pipeline
+stage_seconds = registry.histogram('planner_stage_seconds', 'Time spent in each planning stage', ['stage'])
+kmeans_iterations = registry.histogram('planner_kmeans_iterations', 'KMeans iterations per clustering run', buckets=COUNT_BUCKETS)
+route_moves = registry.counter('planner_route_moves_total', 'Route improvements applied by the optimizer', ['move'])
+planning_admissions = registry.counter('planner_admissions_total', 'Planning requests admitted or refused (busy, user_rate, global_rate, api_rate)', ['result'])
+
+# Web requests and database
+request_seconds = registry.histogram('http_request_duration_seconds', 'Request latency', ['endpoint', 'method', 'status'])
+request_queries = registry.histogram('http_request_db_queries', 'SQL statements executed per request', ['endpoint'], buckets=COUNT_BUCKETS)
+commit_seconds = registry.histogram('db_commit_duration_seconds', 'Time spent committing database transactions', ['endpoint'])
+slow_profiles = registry.counter('http_slow_request_profiles_total', 'cProfile dumps written for slow requests', ['endpoint'])
+
+# Caches whose hit/miss counters are read at scrape time (name -> LRUCache)
+_caches = {}
+
+def _cache_stat(field):
+    return lambda: {(name,): cache.stats()[field] for name, cache in _caches.items()}
+
+registry.callback('cache_hits_total', 'Cache hits', 'counter', ['cache'], _cache_stat('hits'))
+registry.callback('cache_misses_total', 'Cache misses', 'counter', ['cache'], _cache_stat('misses'))
+registry.callback('cache_entries', 'Entries currently cached', 'gauge', ['cache'], _cache_stat('size'))
+
+def register_cache(name, cache):
+    _caches[name] = cache
+
+# Decorator recording how long a planning stage takes
+def timed(stage):
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                stage_seconds.observe(time.perf_counter() - start, stage=stage)
+        return wrapper
+    return decorator
+
+# Only one cProfile can be active per process, so sampled requests take turns
+_profile_lock = threading.Lock()
+
+# Per-request instrumentation: latency, SQL statements, commit time and sampled profiling of slow requests
+def init_app(app):
+    sample_rate = app.config.get('PROFILE_SAMPLE_RATE', 0)
+    slow_seconds = app.config.get('PROFILE_SLOW_REQUEST_SECONDS', 1.0)
+    profile_dir = app.config.get('PROFILE_DIR')
+
+    @app.before_request
+    def start_request_metrics():
+        g.metrics_start = time.perf_counter()
+        g.query_count = 0
+        if profile_dir and sample_rate and random.random() < sample_rate and _profile_lock.acquire(blocking=False):
+            g.profiler = cProfile.Profile()
+            g.profiler.enable()
+
+    @app.after_request
+    def record_request_metrics(response):
+        if 'metrics_start' not in g:
+            return response
+        elapsed = time.perf_counter() - g.metrics_start
+        endpoint = request.endpoint or 'unknown'
+        request_seconds.observe(elapsed, endpoint=endpoint, method=request.method, status=response.status_code)
+        request_queries.observe(g.query_count, endpoint=endpoint)
+
+        profiler = g.pop('profiler', None)
+        if profiler is not None:
+            profiler.disable()
+            try:
+                if elapsed >= slow_seconds:
+                    os.makedirs(profile_dir, exist_ok=True)
+                    filename = '%d-%s-%dms.prof' % (time.time() * 1000, endpoint.replace('.', '_'), elapsed * 1000)
+                    profiler.dump_stats(os.path.join(profile_dir, filename))
+                    slow_profiles.inc(endpoint=endpoint)
+            finally:
+                _profile_lock.release()
+        return response
+
+    @app.teardown_request
+    def stop_profiler(exc):
+        # Requests that raised skip after_request; make sure the profiler is released
+        profiler = g.pop('profiler', None)
+        if profiler is not None:
+            profiler.disable()
+            _profile_lock.release()
+
+
+# Count SQL statements issued while handling a request
+@event.listens_for(Engine, 'before_cursor_execute')
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and 'query_count' in g:
+        g.query_count += 1
+
+# Time every commit (ORM sessions, including the ones in routes.py and the planning jobs)
+@event.listens_for(Session, 'before_commit')
+def _start_commit_timer(session):
+    session.info['commit_start'] = time.perf_counter()
+
+@event.listens_for(Session, 'after_commit')
+def _record_commit_time(session):
+    start = session.info.pop('commit_start', None)
+    if start is not None:
+        endpoint = (request.endpoint or 'unknown') if has_request_context() else 'background'
+        commit_seconds.observe(time.perf_counter() - start, endpoint=endpoint)
+
+@event.listens_for(Session, 'after_rollback')
+def _clear_commit_timer(session):
+    session.info.pop('commit_start', None)
@@ -34,10 +34,12 @@ class Itinerary(db.Model):
     id = db.Column(db.Integer, primary_key=True)  # Unique ID for the itinerary
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)  # Foreign key to link itinerary to user
     name = db.Column(db.String(100), nullable=False)  # Name of the itinerary (e.g., "Summer Vacation")
+    city = db.Column(db.String(100), nullable=True)  # City the itinerary was planned for (None = the default city)
     date_created = db.Column(db.DateTime, default=datetime.utcnow)  # Date the itinerary was created (defaults to current time)
 
     # Relationship to POIs: One-to-many (one itinerary can have many POIs)
-    pois = db.relationship('POI', back_populates='itinerary', cascade='all, delete-orphan')
+    pois = db.relationship('POI', back_populates='itinerary', cascade='all, delete-orphan',
+                           order_by='[POI.day, POI.position, POI.id]')
 
     # Relationship to User: One-to-one (each itinerary belongs to one user)
     user = db.relationship('User', back_populates='itineraries')
@@ -59,7 +61,9 @@ class POI(db.Model):
     original_latitude = db.Column(db.Float)  # Original latitude (before any transformations)
     original_longitude = db.Column(db.Float)  # Original longitude (before any transformations)
     day = db.Column(db.Integer, nullable=False)  # The day number (NOT NULL), represents which day the POI appears on in the itinerary
-    itinerary_id = db.Column(db.Integer, db.ForeignKey('itinerary.id'), nullable=False)  # Foreign key to link POI to itinerary
+    position = db.Column(db.Integer, nullable=True)  # Visiting order within the day (None for POIs saved before editing existed: ordered by ID)
+    pinned = db.Column(db.Boolean, nullable=True, default=False)  # Pinned POIs keep their place when the day is re-optimized
+    itinerary_id = db.Column(db.Integer, db.ForeignKey('itinerary.id'), nullable=False, index=True)  # Foreign key to link POI to itinerary
 
     # Relationship to Itinerary: Many-to-one (many POIs belong to one itinerary)
     itinerary = db.relationship('Itinerary', back_populates='pois')
@@ -73,10 +77,11 @@ class Upload(db.Model):
     # The 'Upload' class represents user uploads (either a blog or vlog)
     id = db.Column(db.Integer, primary_key=True)  # Unique ID for the upload
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)  # Foreign key to link the upload to a user
-    upload_type = db.Column(db.String(10), nullable=False)  # Type of upload ('blog' or 'vlog')
-    filename = db.Column(db.String(120), nullable=True)  # Filename for the blog (if it's a blog)
-    vlog_url = db.Column(db.String(255), nullable=True)  # URL for the vlog (if it's a vlog, could be YouTube or local path)
+    upload_type = db.Column(db.String(10), nullable=False, index=True)  # Type of upload ('blog' or 'vlog')
+    filename = db.Column(db.String(120), nullable=True)  # Name of the uploaded file (blog or video file; the file itself is stored by content hash)
+    vlog_url = db.Column(db.String(255), nullable=True)  # URL for a linked vlog (e.g. YouTube; older uploads also stored a local path here)
     vlog_title = db.Column(db.String(120), nullable=True)  # Title for the vlog (optional)
+    content_hash = db.Column(db.String(64), nullable=True, index=True)  # SHA-256 of the uploaded file, its key in the media store
     timestamp = db.Column(db.DateTime, default=db.func.current_timestamp())  # Timestamp of when the upload was created (defaults to current time)
 
     # Relationship to User: One-to-many (one user can have multiple uploads)
@@ -85,6 +90,8 @@ class Upload(db.Model):
 # Like model for handling user likes on uploads
 class Like(db.Model):
     # The 'Like' class represents a like on an upload (blog or vlog)
+    __table_args__ = (db.Index('ix_like_user_id_upload_id', 'user_id', 'upload_id'),)  # "Has this user liked this upload?" lookups
+
     id = db.Column(db.Integer, primary_key=True)  # Unique ID for the like
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)  # Foreign key to link the like to a user
     upload_id = db.Column(db.Integer, db.ForeignKey('upload.id'), nullable=False)  # Foreign key to link the like to an upload
@@ -118,3 +125,47 @@ class Comment(db.Model):
         # String representation of the Comment object
         return f'<Comment {self.id}>'
 
+# PlanningJob model for itinerary generation running in the background
+class PlanningJob(db.Model):
+    # The 'PlanningJob' class tracks one queued itinerary generation request and its result
+    __tablename__ = 'planning_job'
+
+    id = db.Column(db.String(32), primary_key=True)  # Random job ID (hex UUID) handed to the client
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)  # Foreign key to the user who requested the plan
+    status = db.Column(db.String(10), nullable=False, default='queued')  # 'queued', 'running', 'done' or 'failed'
+    params = db.Column(db.Text, nullable=False)  # Planning parameters (JSON)
+    result = db.Column(db.Text, nullable=True)  # Generated itineraries (JSON), set when the job is done; the user's draft until it expires
+    error = db.Column(db.String(255), nullable=True)  # Error message if the job failed
+    date_created = db.Column(db.DateTime, default=datetime.utcnow)  # When the job was queued
+    date_started = db.Column(db.DateTime, nullable=True)  # When a planner thread picked the job up
+    date_finished = db.Column(db.DateTime, nullable=True)  # When the job finished (done or failed)
+
+    # Relationship to User: One-to-many (one user can have many planning jobs)
+    user = db.relationship('User', backref=db.backref('planning_jobs', cascade='all, delete-orphan'))
+
+    def __repr__(self):
+        # String representation of the PlanningJob object
+        return f'<PlanningJob {self.id} {self.status}>'
+
+# UploadSession model for large files uploaded in several chunks (resumable uploads)
+class UploadSession(db.Model):
+    # The 'UploadSession' class tracks a partially received upload until its last chunk arrives
+    __tablename__ = 'upload_session'
+
+    id = db.Column(db.String(32), primary_key=True)  # Random session ID (hex UUID) handed to the client
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)  # Foreign key to the uploading user
+    upload_type = db.Column(db.String(10), nullable=False)  # Type of upload ('blog' or 'vlog')
+    filename = db.Column(db.String(120), nullable=False)  # Secure file name the upload is stored under
+    title = db.Column(db.String(120), nullable=True)  # Vlog title (optional)
+    total_size = db.Column(db.BigInteger, nullable=False)  # Size of the complete file in bytes
+    received = db.Column(db.BigInteger, nullable=False, default=0)  # Bytes received so far (the offset of the next chunk)
+    date_created = db.Column(db.DateTime, default=datetime.utcnow)  # When the upload was started
+    date_updated = db.Column(db.DateTime, default=datetime.utcnow)  # When the last chunk arrived (stale sessions are expired)
+
+    # Relationship to User: One-to-many (one user can have several uploads in progress)
+    user = db.relationship('User', backref=db.backref('upload_sessions', cascade='all, delete-orphan'))
+
+    def __repr__(self):
+        # String representation of the UploadSession object
+        return f'<UploadSession {self.id} {self.received}/{self.total_size}>'
+
@@ -0,0 +1,235 @@
+# Precomputed "nearby alternatives": for every POI of a catalog, its k nearest POIs that share at least
+# one activity tag with it (POIs without tags take their nearest POIs of any kind)
+#
+# Layout: magic, header length (uint32), JSON header, then 64-byte aligned sections:
+#   neighbors   uint32 (rows x k) catalog rows, nearest first (NO_NEIGHBOR pads short lists)
+#   distances   float32 (rows x k) great-circle distances in km
+# The file sits next to the dataset and is memory-mapped read-only. It records the catalog version it was
+# built from; a stale file is ignored and neighbours are computed on demand instead.
+#
+# Build (from the project root):
+#   python -m app.neighbors                      # every city dataset in dataset/, skipping fresh files
+#   python -m app.neighbors dataset/*.csv --k 20 --force
+import argparse
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+import numpy as np
+from app.poi_store import _align
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'POINBRS1'
+FORMAT_VERSION = 1
+NEIGHBORS_SUFFIX = '.neighbors'
+NO_NEIGHBOR = np.iinfo(np.uint32).max
+
+# Neighbours stored per POI by default: enough for ALTERNATIVES_MAX suggestions after leaving out the POIs
+# an itinerary already visits, so requests rarely need the on-demand search
+DEFAULT_K = 30
+
+# Candidate growth factor when too few of the nearest POIs share a tag, and the candidate count from
+# which a POI's neighbours are found by scanning the POIs sharing its tags instead
+GROWTH = 4
+MAX_TREE_CANDIDATES = 1024
+
+EARTH_RADIUS_KM = 6371.0
+
+# Neighbour file for a dataset CSV (written next to it)
+def neighbors_path(csv_path):
+    return os.path.splitext(csv_path)[0] + NEIGHBORS_SUFFIX
+
+# Coordinates as points on the unit sphere: straight-line distance between them grows with the
+# great-circle distance, so a KD-tree over them finds true nearest neighbours anywhere on Earth
+def sphere_points(latitude, longitude):
+    lat, lon = np.radians(latitude), np.radians(longitude)
+    return np.column_stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)])
+
+def chord_to_km(chord):
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.minimum(np.asarray(chord) / 2, 1.0))
+
+# Nearest tag-sharing neighbours of `rows`: returns (neighbors, distances_km), each len(rows) x k
+def find_neighbors(points, activity_bits, tree, rows, k):
+    n = len(points)
+    neighbors = np.full((len(rows), k), NO_NEIGHBOR, dtype=np.uint32)
+    distances = np.full((len(rows), k), np.inf, dtype=np.float32)
+    pending, want = np.arange(len(rows)), k * GROWTH + 1
+    while len(pending):
+        query_rows = rows[pending]
+        chords, candidates = tree.query(points[query_rows], k=min(want, n))
+        chords, candidates = chords.reshape(len(pending), -1), candidates.reshape(len(pending), -1)
+        bits = activity_bits[query_rows][:, None]
+        ok = (candidates != query_rows[:, None]) & (((activity_bits[candidates] & bits) != 0) | (bits == 0))
+
+        done = (ok.sum(axis=1) >= k) | (want >= n)
+        first = np.argsort(~ok[done], axis=1, kind='stable')[:, :k]  # First k accepted candidates, nearest first
+        found = np.take_along_axis(ok[done], first, axis=1)
+        picked = np.take_along_axis(candidates[done], first, axis=1)
+        neighbors[pending[done], :first.shape[1]] = np.where(found, picked, NO_NEIGHBOR)
+        distances[pending[done], :first.shape[1]] = np.where(found, chord_to_km(np.take_along_axis(chords[done], first, axis=1)), np.inf)
+        pending, want = pending[~done], want * GROWTH
+
+        # POIs whose tags are rare nearby: scan the POIs sharing a tag rather than growing the query further
+        if want > MAX_TREE_CANDIDATES:
+            for i in pending:
+                row = rows[i]
+                sharing = np.flatnonzero(activity_bits & activity_bits[row]) if activity_bits[row] else np.arange(n)
+                sharing = sharing[sharing != row]
+                chord = np.linalg.norm(points[sharing] - points[row], axis=1)
+                nearest = np.lexsort((sharing, chord))[:k]
+                neighbors[i, :len(nearest)] = sharing[nearest]
+                distances[i, :len(nearest)] = chord_to_km(chord[nearest])
+            break
+    return neighbors, distances
+
+# Read-only view of a neighbour file
+class NeighborLists:
+    def __init__(self, path, header, neighbors, distances, buffer):
+        self.path = path
+        self.header = header
+        self.neighbors = neighbors  # rows x k
+        self.distances = distances
+        self._buffer = buffer       # Keeps the mapping open while the arrays are in use
+
+    @property
+    def k(self):
+        return self.header['k']
+
+    @property
+    def version(self):
+        return self.header['catalog_version']
+
+    # Memory-map a neighbour file (raises ValueError if it is not a compatible file)
+    @classmethod
+    def open(cls, path):
+        with open(path, 'rb') as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if buffer[:len(MAGIC)] != MAGIC:
+            raise ValueError('%s is not a neighbour file' % path)
+        header_length, = struct.unpack_from('<I', buffer, len(MAGIC))
+        header_start = len(MAGIC) + 4
+        header = json.loads(bytes(buffer[header_start:header_start + header_length]))
+        if header.get('format') != FORMAT_VERSION:
+            raise ValueError('%s has format %r, expected %d' % (path, header.get('format'), FORMAT_VERSION))
+
+        data_start = _align(header_start + header_length)
+        shape = (header['rows'], header['k'])
+        neighbors = np.frombuffer(buffer, dtype=np.uint32, count=shape[0] * shape[1],
+                                  offset=data_start + header['sections']['neighbors']).reshape(shape)
+        distances = np.frombuffer(buffer, dtype=np.float32, count=shape[0] * shape[1],
+                                  offset=data_start + header['sections']['distances']).reshape(shape)
+        return cls(path, header, neighbors, distances, buffer)
+
+# Compute a catalog's neighbour lists and write them (atomically) next to its dataset; returns the path
+def build_neighbors(catalog, k=DEFAULT_K, out_path=None):
+    from scipy.spatial import cKDTree
+
+    out_path = out_path or neighbors_path(catalog.path)
+    k = max(0, min(k, len(catalog) - 1))
+    points = sphere_points(catalog.latitude, catalog.longitude)
+    tree = cKDTree(points)
+    neighbors = np.empty((len(catalog), k), dtype=np.uint32)
+    distances = np.empty((len(catalog), k), dtype=np.float32)
+    for start in range(0, len(catalog), 65536):
+        rows = np.arange(start, min(start + 65536, len(catalog)))
+        neighbors[rows], distances[rows] = find_neighbors(points, catalog.activity_bits, tree, rows, k)
+
+    distances_offset = _align(neighbors.nbytes)
+    header = json.dumps({
+        'format': FORMAT_VERSION,
+        'rows': len(catalog),
+        'k': k,
+        'catalog_version': catalog.version,
+        'sections': {'neighbors': 0, 'distances': distances_offset},
+    }).encode('utf-8')
+
+    tmp_path = '%s.%d.tmp' % (out_path, os.getpid())
+    with open(tmp_path, 'wb') as f:
+        f.write(MAGIC + struct.pack('<I', len(header)) + header)
+        data_start = _align(f.tell())
+        f.seek(data_start)
+        f.write(neighbors.tobytes())
+        f.seek(data_start + distances_offset)
+        f.write(distances.tobytes())
+    os.replace(tmp_path, out_path)
+    return out_path
+
+# Nearby alternatives for one catalog: served from the precomputed file when it matches the catalog,
+# otherwise computed per request with a KD-tree over the catalog (built on first use)
+class NearbyIndex:
+    def __init__(self, catalog, lists=None):
+        self.catalog = catalog
+        self.lists = lists
+        self._points = None
+        self._tree = None
+
+    @classmethod
+    def for_catalog(cls, catalog):
+        path = neighbors_path(catalog.path)
+        lists = None
+        if os.path.exists(path):
+            try:
+                lists = NeighborLists.open(path)
+                if lists.version != catalog.version or lists.header['rows'] != len(catalog):
+                    logger.warning('%s was built for another version of %s; computing neighbours on demand '
+                                   '(rebuild with python -m app.neighbors)', path, catalog.path)
+                    lists = None
+            except ValueError as e:
+                logger.warning('Ignoring neighbour file: %s', e)
+        return cls(catalog, lists)
+
+    # Rows and distances (km) of up to k tag-sharing POIs nearest to `row`, nearest first, leaving out POIs
+    # named in `exclude`
+    # The stored list is filtered first; the KD-tree is only used when too few of its POIs remain
+    def nearby(self, row, k, exclude=()):
+        if self.lists is not None:
+            rows, distances = self._filter(self.lists.neighbors[row], self.lists.distances[row], exclude)
+            # A padded list already holds every tag-sharing POI, so searching further finds nothing new
+            complete = self.lists.k == 0 or self.lists.neighbors[row, -1] == NO_NEIGHBOR
+            if len(rows) >= k or complete:
+                return rows[:k], distances[:k]
+
+        if self._tree is None:
+            from scipy.spatial import cKDTree
+            self._points = sphere_points(self.catalog.latitude, self.catalog.longitude)
+            self._tree = cKDTree(self._points)
+        want = min(k + len(exclude), len(self.catalog) - 1)
+        rows, distances = find_neighbors(self._points, self.catalog.activity_bits, self._tree, np.array([row]), want)
+        rows, distances = self._filter(rows[0], distances[0], exclude)
+        return rows[:k], distances[:k]
+
+    def _filter(self, rows, distances, exclude):
+        keep = rows != NO_NEIGHBOR
+        if exclude:
+            keep &= np.array([row == NO_NEIGHBOR or self.catalog.names[row] not in exclude for row in rows.tolist()], dtype=bool)
+        return rows[keep], distances[keep]
+
+def main(argv=None):
+    from app.catalog import DATASET_DIR, POICatalog, discover_cities
+
+    parser = argparse.ArgumentParser(description='Precompute nearby-alternative lists for POI datasets.')
+    parser.add_argument('datasets', nargs='*', help='dataset CSV files (default: every city dataset in %s/)' % DATASET_DIR)
+    parser.add_argument('--k', type=int, default=DEFAULT_K, help='neighbours per POI (default: %d)' % DEFAULT_K)
+    parser.add_argument('--force', action='store_true', help='rebuild even if the file is up to date')
+    args = parser.parse_args(argv)
+
+    datasets = args.datasets or list(discover_cities(DATASET_DIR).values())
+    for csv_path in datasets:
+        catalog = POICatalog.load(csv_path)
+        path = neighbors_path(csv_path)
+        if not args.force and os.path.exists(path):
+            try:
+                lists = NeighborLists.open(path)
+                if lists.version == catalog.version and lists.k >= min(args.k, len(catalog) - 1):
+                    print('%s is up to date' % path)
+                    continue
+            except ValueError:
+                pass  # Old or foreign format: rebuild it
+        build_neighbors(catalog, args.k, path)
+        print('Built %s (%d bytes)' % (path, os.path.getsize(path)))
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,45 @@
+from datetime import datetime
+from sqlalchemy import insert
+from app import db
+from app.models import Itinerary, POI
+
+# Column values for one POI row (accepts generated or user-submitted POI dicts)
+def poi_row(poi, itinerary_id):
+    return {
+        'itinerary_id': itinerary_id,
+        'name': poi.get('name'),
+        'address': poi.get('address', ''),
+        'latitude': poi.get('latitude'),
+        'longitude': poi.get('longitude'),
+        'original_latitude': poi.get('original_latitude', poi.get('latitude')),
+        'original_longitude': poi.get('original_longitude', poi.get('longitude')),
+        'day': poi.get('day', 1),  # Default day is 1 if not provided
+        'pinned': False,
+    }
+
+# Insert POIs for an existing itinerary with a single multi-row INSERT (no ORM objects or flushes)
+# POIs are numbered within their day in the order given (the optimized visiting order)
+def bulk_insert_pois(itinerary_id, pois):
+    rows, positions = [], {}
+    for poi in pois:
+        row = poi_row(poi, itinerary_id)
+        row['position'] = positions[row['day']] = positions.get(row['day'], -1) + 1
+        rows.append(row)
+    if rows:
+        db.session.execute(insert(POI), rows)
+    return len(rows)
+
+# Save an itinerary and all of its POIs in one transaction and return the new itinerary ID
+def save_itinerary_with_pois(user_id, name, pois, city=None):
+    try:
+        itinerary = Itinerary(name=name, user_id=user_id, city=city, date_created=datetime.utcnow())
+        db.session.add(itinerary)
+        db.session.flush()  # Assigns itinerary.id without committing
+        itinerary_id = itinerary.id
+
+        bulk_insert_pois(itinerary_id, pois)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()  # Nothing is saved if any row fails
+        raise
+    return itinerary_id
@@ -0,0 +1,210 @@
+# Compact binary POI store, compiled offline from a POI dataset CSV
+#
+# Layout: magic, header length (uint32), JSON header, then 64-byte aligned sections:
+#   latitude, longitude  float32 coordinates
+#   activity_bits        uint16 per POI (bit i = ACTIVITY_COLS[i])
+#   name_ids, address_ids uint32 indexes into the interned string table
+#   string_offsets       uint64 offsets into string_data (len = strings + 1)
+#   string_data          UTF-8 bytes of every distinct name/address
+# The file is memory-mapped read-only, so workers share its pages through the OS page cache.
+#
+# Build (from the project root):
+#   python -m app.poi_store                      # every city dataset in dataset/, skipping fresh stores
+#   python -m app.poi_store dataset/*.csv --force
+import argparse
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+import numpy as np
+
+MAGIC = b'POISTORE'
+FORMAT_VERSION = 1
+ALIGNMENT = 64
+STORE_SUFFIX = '.poistore'
+
+# Coordinates are stored as float32 (~0.5 m at London's latitude) and rounded to this many decimals when read
+COORD_DECIMALS = 5
+
+# Store file compiled from a dataset CSV (written next to it)
+def store_path(csv_path):
+    return os.path.splitext(csv_path)[0] + STORE_SUFFIX
+
+# SHA-1 of a file's contents (the dataset version used in cache keys)
+def file_sha1(path):
+    with open(path, 'rb') as f:
+        return hashlib.file_digest(f, 'sha1').hexdigest()
+
+# Interned strings, read straight out of the mapped file
+class StringTable:
+    def __init__(self, data, offsets):
+        self.data = data
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return bytes(self.data[self.offsets[i]:self.offsets[i + 1]]).decode('utf-8')
+
+    # Intern a list of strings: returns (ids, offsets, data)
+    @staticmethod
+    def build(values):
+        index = {}
+        ids = np.empty(len(values), dtype=np.uint32)
+        for i, value in enumerate(values):
+            ids[i] = index.setdefault(value, len(index))
+        encoded = [value.encode('utf-8') for value in index]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.uint64)
+        np.cumsum([len(value) for value in encoded], out=offsets[1:])
+        return ids, offsets, np.frombuffer(b''.join(encoded), dtype=np.uint8)
+
+# One column of interned strings (e.g. POI names), indexed by catalog row
+class InternedColumn:
+    def __init__(self, table, ids):
+        self.table = table
+        self.ids = ids
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, row):
+        return self.table[self.ids[row]]
+
+# Read-only view of a store file
+class POIStore:
+    def __init__(self, path, header, sections, buffer):
+        self.path = path
+        self.header = header
+        self.sections = sections  # Section name -> NumPy array backed by the mapping
+        self._buffer = buffer     # Keeps the mapping open while the arrays are in use
+
+        strings = StringTable(sections['string_data'], sections['string_offsets'])
+        self.names = InternedColumn(strings, sections['name_ids'])
+        self.addresses = InternedColumn(strings, sections['address_ids'])
+        self.activity_bits = sections['activity_bits']
+
+    def __len__(self):
+        return self.header['rows']
+
+    # Dataset version for cache keys: SHA-1 of the source CSV, tagged because coordinates are rounded
+    @property
+    def version(self):
+        return '%s-store%d' % (self.header['source_sha1'], FORMAT_VERSION)
+
+    # Original coordinates as float64, rounded back to the precision float32 can hold
+    def coordinates(self):
+        latitude = np.round(self.sections['latitude'].astype(np.float64), COORD_DECIMALS)
+        longitude = np.round(self.sections['longitude'].astype(np.float64), COORD_DECIMALS)
+        return latitude, longitude
+
+    # True if the store was built from the current contents of csv_path (or the CSV is not deployed)
+    def is_fresh_for(self, csv_path):
+        try:
+            stat = os.stat(csv_path)
+        except FileNotFoundError:
+            return True
+        if stat.st_size != self.header['source_size']:
+            return False
+        if stat.st_mtime_ns == self.header['source_mtime']:
+            return True
+        # Same size but touched (e.g. by a checkout): compare contents, still far cheaper than parsing
+        return file_sha1(csv_path) == self.header['source_sha1']
+
+    # Memory-map a store file (raises ValueError if it is not a compatible store)
+    @classmethod
+    def open(cls, path, activity_cols=None):
+        with open(path, 'rb') as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if buffer[:len(MAGIC)] != MAGIC:
+            raise ValueError('%s is not a POI store' % path)
+        header_length, = struct.unpack_from('<I', buffer, len(MAGIC))
+        header_start = len(MAGIC) + 4
+        header = json.loads(bytes(buffer[header_start:header_start + header_length]))
+        if header.get('format') != FORMAT_VERSION:
+            raise ValueError('%s has store format %r, expected %d' % (path, header.get('format'), FORMAT_VERSION))
+        if activity_cols is not None and header['activity_cols'] != list(activity_cols):
+            raise ValueError('%s was built for different activity columns' % path)
+
+        data_start = _align(header_start + header_length)
+        sections = {
+            name: np.frombuffer(buffer, dtype=section['dtype'], count=section['count'], offset=data_start + section['offset'])
+            for name, section in header['sections'].items()
+        }
+        return cls(path, header, sections, buffer)
+
+def _align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+# Compile a dataset CSV into a store file (written atomically) and return its path
+def build_store(csv_path, out_path=None):
+    from app.activities import ACTIVITY_COLS
+    from app.Itinerary import load_poi_data  # pandas is only imported when a CSV has to be parsed
+
+    out_path = out_path or store_path(csv_path)
+    stat = os.stat(csv_path)
+    df = load_poi_data(csv_path)
+
+    weights = np.array([1 << i for i in range(len(ACTIVITY_COLS))], dtype=np.uint16)
+    strings = df['name'].astype(str).tolist() + df['address'].fillna('').astype(str).tolist()
+    ids, string_offsets, string_data = StringTable.build(strings)
+    arrays = {
+        'latitude': df['Original_Latitude'].to_numpy(dtype=np.float32),
+        'longitude': df['Original_Longitude'].to_numpy(dtype=np.float32),
+        'activity_bits': ((df[ACTIVITY_COLS].to_numpy() > 0) * weights).sum(axis=1, dtype=np.uint16),
+        'name_ids': ids[:len(df)],
+        'address_ids': ids[len(df):],
+        'string_offsets': string_offsets,
+        'string_data': string_data,
+    }
+
+    sections, offset = {}, 0
+    for name, array in arrays.items():
+        sections[name] = {'dtype': array.dtype.str, 'count': len(array), 'offset': offset}
+        offset = _align(offset + array.nbytes)
+    header = json.dumps({
+        'format': FORMAT_VERSION,
+        'rows': len(df),
+        'activity_cols': list(ACTIVITY_COLS),
+        'source_sha1': file_sha1(csv_path),
+        'source_size': stat.st_size,
+        'source_mtime': stat.st_mtime_ns,
+        'sections': sections,
+    }).encode('utf-8')
+
+    tmp_path = '%s.%d.tmp' % (out_path, os.getpid())
+    with open(tmp_path, 'wb') as f:
+        f.write(MAGIC + struct.pack('<I', len(header)) + header)
+        data_start = _align(f.tell())
+        for name, array in arrays.items():
+            f.seek(data_start + sections[name]['offset'])
+            f.write(np.ascontiguousarray(array).tobytes())
+        f.truncate(data_start + offset)  # Pad to the end of the last section
+    os.replace(tmp_path, out_path)  # Running workers keep their old mapping until they reload
+    return out_path
+
+def main(argv=None):
+    from app.catalog import DATASET_DIR, discover_cities
+
+    parser = argparse.ArgumentParser(description='Compile POI dataset CSVs into memory-mappable stores.')
+    parser.add_argument('datasets', nargs='*', help='dataset CSV files (default: every city dataset in %s/)' % DATASET_DIR)
+    parser.add_argument('--force', action='store_true', help='rebuild even if the store is up to date')
+    args = parser.parse_args(argv)
+
+    datasets = args.datasets or [path for path in discover_cities(DATASET_DIR).values() if os.path.exists(path)]
+    for csv_path in datasets:
+        path = store_path(csv_path)
+        if not args.force and os.path.exists(path):
+            try:
+                if POIStore.open(path).is_fresh_for(csv_path):
+                    print('%s is up to date' % path)
+                    continue
+            except ValueError:
+                pass  # Old or foreign format: rebuild it
+        build_store(csv_path, path)
+        print('Built %s (%d bytes)' % (path, os.path.getsize(path)))
+
+if __name__ == '__main__':
+    sys.exit(main())
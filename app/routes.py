@@ -1,17 +1,29 @@
 
-from flask import Blueprint, session, request, render_template, redirect, url_for, flash
+from flask import Blueprint, session, request, render_template, redirect, url_for, flash, jsonify, make_response, abort, send_file
 from flask_login import current_user, login_required, login_user, logout_user
 from app import db, bcrypt
-from app.models import User, Itinerary, POI, Upload, Like, Comment
+from app.models import User, Itinerary, Upload, Like, Comment, PlanningJob, UploadSession
 from app.forms import RegistrationForm, LoginForm
 from app.forms import UploadForm
-from app.Itinerary import load_poi_data, normalize_coordinates, filter_pois_by_activity, apply_kmeans, select_representative_pois, generate_itineraries
-import pandas as pd
+from app.activities import ACTIVITY_COLS
+from app.jobs import planning_queue
+from app.admission import admission
+from app.persistence import save_itinerary_with_pois
+from app.maps import map_fingerprint, render_map_html
+from app.cache import map_cache
+from app.catalog import city_catalogs
+from app import metrics
+from app.uploads import upload_kind, size_limit, create_session, append_chunk, finish_session
+from app.uploads import blob_path, media_url, remove_upload_file
 import json  # For serializing POIs data
-from datetime import datetime
-import folium  # For rendering interactive maps
 from werkzeug.utils import secure_filename
+from flask_wtf.csrf import validate_csrf
+from wtforms.validators import ValidationError
+from sqlalchemy import func
+from sqlalchemy.orm import joinedload, selectinload
+import mimetypes
 import os
+import re
 from flask import current_app
 
 # Blueprint to handle routes related to the main functionalities (home, user, and admin tasks)
@@ -122,91 +134,90 @@ def delete_user(user_id):
 @main.route('/plan_trip', methods=['GET', 'POST'])
 @login_required
 def plan_trip():
-    # Load and prepare the dataset for POIs (points of interest)
-    df = load_poi_data()
-    df = normalize_coordinates(df)  # Normalize the coordinates for clustering
-
-    # List of available activity types for filtering POIs
-    activity_cols = [
-        'nature', 'nightlife', 'drink', 'music', 'dance', 'history',
-        'sports', 'art', 'museum', 'walk', 'restaurant', 'movie'
-    ]
-
     # Process form data when the user selects activities and submits the form
     if request.method == 'POST':
-        days = int(request.form['days'])
+        days = request.form.get('days', type=int)
         selected_activities = request.form.getlist('interests')  # Selected activities
+        city = request.form.get('city') or city_catalogs.default_city
+
+        if city not in city_catalogs.cities():
+            flash("Sorry, we don't have itineraries for that city yet.", "danger")
+            return redirect(url_for('main.plan_trip'))
+
+        try:
+            admission.check_bounds(days or 0)
+        except ValueError:
+            flash("Please choose a trip of 1 to %d days." % admission.max_days, "danger")
+            return redirect(url_for('main.plan_trip'))
+
+        # Same checks as the API, so bad input never spends a rate-limit token or a planner slot
+        if not selected_activities or any(activity not in ACTIVITY_COLS for activity in selected_activities):
+            flash("Please choose at least one of the listed activities.", "danger")
+            return redirect(url_for('main.plan_trip'))
+
+        # Refuse with 429 (and Retry-After) if this user or the site is planning too much right now
+        admission.admit(current_user.id)
 
-        # Filter POIs based on selected activities
-        filtered_df = filter_pois_by_activity(df, selected_activities)
+        # Queue the generation (filtering, K-Means, POI selection and route optimization)
+        # so the web worker is free again immediately
+        job_id = planning_queue.submit(current_user.id, {'city': city, 'activities': selected_activities, 'days': days},
+                                       on_finish=admission.release)
+        return redirect(url_for('main.plan_trip_job', job_id=job_id))
 
-        # Apply K-Means clustering to POIs
-        clustered_df, kmeans = apply_kmeans(filtered_df, days)
+    return render_template('plan_trip.html', activities=ACTIVITY_COLS, max_days=admission.max_days,
+                           cities=sorted(city_catalogs.cities()), default_city=city_catalogs.default_city)
 
-        # Select representative POIs based on clusters
-        representative_pois = select_representative_pois(clustered_df, kmeans)
+# Planning Job Route - Show the generated itinerary, or a waiting page while it is being generated
+@main.route('/plan_trip/jobs/<job_id>')
+@login_required
+def plan_trip_job(job_id):
+    job = PlanningJob.query.filter_by(id=job_id, user_id=current_user.id).first_or_404()
+    planning_queue.expire_if_stale(job)
 
-        # Generate itineraries based on the selected POIs and activities
-        itineraries = generate_itineraries(representative_pois, selected_activities, days)
+    if job.status == 'done':
+        itineraries = json.loads(job.result)
+        return render_template('show_itinerary.html', itineraries=itineraries, draft_id=job.id)
 
-        return render_template('show_itinerary.html', itineraries=itineraries)
+    if job.status == 'failed':
+        flash("We couldn't generate your itinerary. Please try again.", "danger")
+        return redirect(url_for('main.plan_trip'))
 
-    return render_template('plan_trip.html', activities=activity_cols)
+    return render_template('plan_trip_wait.html', status_url=url_for('main.plan_trip_job_status', job_id=job.id))
+
+# Planning Job Status Route - Polled by the waiting page until the itinerary is ready
+@main.route('/plan_trip/jobs/<job_id>/status')
+@login_required
+def plan_trip_job_status(job_id):
+    job = PlanningJob.query.filter_by(id=job_id, user_id=current_user.id).first_or_404()
+    planning_queue.expire_if_stale(job)
+    return jsonify(status=job.status, result_url=url_for('main.plan_trip_job', job_id=job.id))
 
 # Save Itinerary Route - Allow users to save their generated itinerary
+# The form only names the draft (the finished planning job); the POIs are taken from the server's copy
 @main.route('/save_itinerary', methods=['POST'])
 @login_required
 def save_itinerary():
-    itinerary_name = request.form['itinerary_name']
-    pois_data = request.form['pois']  # POI data submitted by the user
+    itinerary_name = request.form.get('itinerary_name', '').strip()
+    draft_id = request.form.get('draft_id', '')
 
-    if not itinerary_name or not pois_data:  # Ensure both name and POIs are provided
+    if not itinerary_name or not draft_id:  # Ensure both name and itinerary are provided
         flash("Itinerary name and POIs cannot be empty", "danger")
         return redirect(url_for('main.plan_trip'))
 
-    try:
-        poi_dict_list = json.loads(pois_data)  # Parse POI data from JSON format
-        print("POI List:", poi_dict_list)
-    except json.JSONDecodeError:
-        flash("Invalid POI data", "danger")
+    draft = planning_queue.get_draft(current_user.id, draft_id)
+    if draft is None:
+        flash("This itinerary has expired. Please plan your trip again.", "warning")
         return redirect(url_for('main.plan_trip'))
 
-    flat_pois = [poi for day in poi_dict_list for poi in day]  # Flatten the POI list
-    poi_instances = []  # List to store POI instances for saving to DB
-
-    # Create POI instances and append to the list
-    for poi in flat_pois:
-        if not isinstance(poi, dict):
-            flash("There was an issue with your POI data. Please check and try again.", "danger")
-            return redirect(url_for('main.plan_trip'))
-
-        day_value = poi.get('day', 1)  # Default day is 1 if not provided
-        poi_instance = POI(
-            name=poi.get('name'),
-            address=poi.get('address', ''),
-            latitude=poi.get('latitude'),
-            longitude=poi.get('longitude'),
-            original_latitude=poi.get('original_latitude', poi.get('latitude')),
-            original_longitude=poi.get('original_longitude', poi.get('longitude')),
-            day=day_value
-        )
-        poi_instances.append(poi_instance)
-
-    # Create and save the itinerary
-    new_itinerary = Itinerary(
-        name=itinerary_name,
-        user_id=current_user.id,
-        pois=poi_instances,
-        date_created=datetime.utcnow()
-    )
+    flat_pois = [poi for day in json.loads(draft.result) for poi in day]  # Flatten the POI list
+    city = json.loads(draft.params).get('city')
 
     try:
-        db.session.add(new_itinerary)
-        db.session.commit()  # Commit to save itinerary to the database
+        # Save the itinerary and all of its POIs in one transaction (single INSERT for the POIs)
+        save_itinerary_with_pois(current_user.id, itinerary_name, flat_pois, city)
         flash("Itinerary saved successfully!", "success")
-    except Exception as e:
-        db.session.rollback()  # Rollback if there is an error
-        print(f"Error saving itinerary: {e}")
+    except Exception:
+        current_app.logger.exception("Error saving itinerary for user %s", current_user.id)
         flash("There was an error saving your itinerary. Please try again.", "danger")
 
     return redirect(url_for('main.view_itineraries'))
@@ -215,11 +226,17 @@ def save_itinerary():
 @main.route('/view_itineraries')
 @login_required
 def view_itineraries():
-    itineraries = Itinerary.query.filter_by(user_id=current_user.id).all()
+    # One page of itineraries, with all their POIs loaded in a single extra query
+    page = request.args.get('page', 1, type=int)
+    pagination = (Itinerary.query
+                  .options(selectinload(Itinerary.pois))
+                  .filter_by(user_id=current_user.id)
+                  .order_by(Itinerary.id)
+                  .paginate(page=page, per_page=current_app.config.get('ITINERARIES_PER_PAGE', 10), error_out=False))
     itineraries_grouped = []
 
     # Group the POIs in each itinerary by day
-    for itinerary in itineraries:
+    for itinerary in pagination.items:
         pois_by_day = {}
         for poi in itinerary.pois:
             pois_by_day.setdefault(poi.day, []).append(poi)
@@ -232,7 +249,7 @@ def view_itineraries():
             'grouped_pois': grouped_pois
         })
     
-    return render_template('view_itineraries.html', itineraries_grouped=itineraries_grouped)
+    return render_template('view_itineraries.html', itineraries_grouped=itineraries_grouped, pagination=pagination)
 
 # View Itinerary Map Route - Display a map for a specific itinerary
 @main.route('/view_itinerary_map/<int:itinerary_id>')
@@ -240,28 +257,32 @@ def view_itineraries():
 def view_itinerary_map(itinerary_id):
     itinerary = Itinerary.query.get_or_404(itinerary_id)
 
-    # Find the first POI with valid original coordinates
-    first_poi = next((p for p in itinerary.pois if p.original_latitude and p.original_longitude), None)
-    if not first_poi:
-        flash("No valid coordinates to display map.", "danger")
-        return redirect(url_for('main.view_itineraries'))
-
-    map_center = [first_poi.original_latitude, first_poi.original_longitude]
-    m = folium.Map(location=map_center, zoom_start=12)
-
-    for poi in itinerary.pois:
-        if poi.original_latitude is None or poi.original_longitude is None:
-            print(f"Skipping POI {poi.name} due to missing coordinates.")
-            continue
-
-        folium.Marker(
-            [poi.original_latitude, poi.original_longitude],
-            popup=folium.Popup(poi.name, parse_html=True),
-            icon=folium.Icon(color="blue")
-        ).add_to(m)
+    # The ETag changes whenever the POIs on the map change, so edits invalidate cached maps
+    etag = map_fingerprint(itinerary.pois)
+    if request.if_none_match.contains(etag):
+        # Browser copy is still current: answer 304 without rendering anything
+        response = current_app.response_class(status=304)
+        response.set_etag(etag)
+        return response
+
+    # Reuse the rendered map HTML if we have it for this exact content
+    cached = map_cache.get(itinerary_id, etag)
+    if cached is None:
+        map_html = render_map_html(itinerary.pois)
+        if map_html is None:
+            flash("No valid coordinates to display map.", "danger")
+            return redirect(url_for('main.view_itineraries'))
+        rendered_at = map_cache.put(itinerary_id, etag, map_html)
+    else:
+        map_html, rendered_at = cached
 
-    map_html = m._repr_html_()
-    return render_template('itinerary_map.html', map_html=map_html)
+    # Let browsers keep the page but revalidate it with the ETag / Last-Modified on every visit
+    response = make_response(render_template('itinerary_map.html', map_html=map_html))
+    response.set_etag(etag)
+    response.last_modified = rendered_at
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
 
 
 # Route to display the dashboard after user login
@@ -278,27 +299,21 @@ def upload():
     form = UploadForm()  # Instantiate the form
 
     if request.method == 'POST':
-        print("POST request received")
         upload_type = request.form.get('upload_type')  # Get the type of upload (blog or vlog)
-        print(f"Upload type: {upload_type}")
 
         # Handling blog file uploads
         if upload_type == 'blog':
             file = request.files.get('blog_file')  # Get the uploaded file
-            print(f"File received: {file}")
 
-            # Check if the file is valid and has an allowed extension
-            if file and file.filename.endswith(('.txt', '.md', '.pdf')):
-                filename = secure_filename(file.filename)  # Secure the file name
-                upload_folder = os.path.join(os.path.dirname(__file__), 'static', 'uploads')  # Folder to save the upload
-                os.makedirs(upload_folder, exist_ok=True)  # Create the folder if it doesn't exist
-                file_path = os.path.join(upload_folder, filename)  # Path to save the file
-                file.save(file_path)  # Save the file
-                print(f"File saved at: {file_path}")
+            # Check if the file is valid and has an allowed extension (it was already streamed to disk while the form was parsed)
+            if file and upload_kind(file.filename) == 'blog':
+                # Move the file into the media store (an identical file uploaded before is reused)
+                filename = secure_filename(file.filename)  # Secure the file name (used for display and downloads)
+                content_hash = file.stream.save()
+                current_app.logger.info("User %s uploaded blog %s", current_user.id, filename)
 
                 # Create a new upload record in the database
-                new_upload = Upload(user_id=current_user.id, upload_type='blog', filename=filename)
-                print(f"New blog upload: {new_upload}") 
+                new_upload = Upload(user_id=current_user.id, upload_type='blog', filename=filename, content_hash=content_hash)
 
                 db.session.add(new_upload)  # Add the new upload to the session
                 db.session.commit()  # Commit the changes to the database
@@ -320,16 +335,11 @@ def upload():
                 flash('Vlog link submitted successfully!', 'success')  # Notify the user of success
 
             # If a file is uploaded, check if it has the correct format
-            elif file and file.filename.endswith(('.mp4', '.mov')):
+            elif file and upload_kind(file.filename) == 'vlog':
                 filename = secure_filename(file.filename)  # Secure the file name
-                upload_folder = os.path.join(os.path.dirname(__file__), 'static', 'uploads')  # Folder to save the upload
-                os.makedirs(upload_folder, exist_ok=True)  # Create the folder if it doesn't exist
-                file_path = os.path.join(upload_folder, filename)  # Path to save the file
-                file.save(file_path)  # Save the file
-
-                # Generate the file URL to access it from the frontend
-                vlog_file_url = url_for('static', filename='uploads/' + filename)
-                new_upload = Upload(user_id=current_user.id, upload_type='vlog', vlog_url=vlog_file_url, vlog_title=vlog_title)
+                content_hash = file.stream.save()  # Served from the media store (see media_url)
+                new_upload = Upload(user_id=current_user.id, upload_type='vlog', vlog_title=vlog_title,
+                                    filename=filename, content_hash=content_hash)
                 db.session.add(new_upload)
                 db.session.commit()
                 flash('Video uploaded successfully!', 'success')  # Notify the user of success
@@ -338,16 +348,121 @@ def upload():
 
         return redirect(url_for('main.dashboard'))  # Redirect the user to the dashboard after upload
 
-    return render_template('upload.html', form=form)  # Render the upload form for GET requests
+    return render_template('upload.html', form=form, chunk_size=current_app.config['UPLOAD_CHUNK_SIZE'])  # Render the upload form for GET requests
+
+# Resumable uploads (used by the upload page for large videos)
+# POST /uploads/sessions starts one, then the file is sent with PUT requests of consecutive byte ranges
+# (Content-Range: bytes <start>-<end>/<total>). GET reports how many bytes arrived, so an interrupted upload
+# resumes from there. Requests carry the form's CSRF token in an X-CSRFToken header.
+def _check_csrf():
+    if not current_app.config.get('WTF_CSRF_ENABLED', True):
+        return
+    try:
+        validate_csrf(request.headers.get('X-CSRFToken'))
+    except ValidationError:
+        abort(400, 'Missing or invalid CSRF token')
+
+def _own_upload_session(session_id):
+    upload_session = db.session.get(UploadSession, session_id)
+    if upload_session is None or upload_session.user_id != current_user.id:
+        abort(404)
+    return upload_session
+
+@main.route('/uploads/sessions', methods=['POST'])
+@login_required
+def start_upload_session():
+    _check_csrf()
+    data = request.get_json(silent=True) or {}
+    filename = secure_filename(str(data.get('filename', '')))
+    kind = upload_kind(filename)
+    if kind is None or kind != data.get('upload_type', kind):
+        return jsonify(error='Only .txt, .md, .pdf (blog) or .mp4, .mov (vlog) files are allowed.'), 400
+    size = data.get('size')
+    if isinstance(size, bool) or not isinstance(size, int) or size < 1:
+        return jsonify(error='size must be a positive integer'), 400
+    if size > size_limit(kind):
+        return jsonify(error='File is larger than %d bytes' % size_limit(kind)), 413
+
+    upload_session = create_session(current_user.id, kind, filename, size, data.get('vlog_title'))
+    return jsonify(session_id=upload_session.id, received=0, chunk_size=current_app.config['UPLOAD_CHUNK_SIZE']), 201
+
+@main.route('/uploads/sessions/<session_id>', methods=['GET'])
+@login_required
+def upload_session_status(session_id):
+    upload_session = _own_upload_session(session_id)
+    return jsonify(session_id=upload_session.id, received=upload_session.received, size=upload_session.total_size)
+
+@main.route('/uploads/sessions/<session_id>', methods=['PUT'])
+@login_required
+def upload_session_chunk(session_id):
+    _check_csrf()
+    upload_session = _own_upload_session(session_id)
+    content_range = re.fullmatch(r'bytes (\d+)-(\d+)/(\d+)', request.headers.get('Content-Range', ''))
+    if content_range is None or int(content_range.group(3)) != upload_session.total_size:
+        return jsonify(error='Expected a Content-Range header for this upload'), 400
+
+    if not append_chunk(upload_session, int(content_range.group(1)), request.stream):
+        # Chunk does not continue the upload (e.g. sent twice after a retry): tell the client where to resume
+        return jsonify(error='Upload is at byte %d' % upload_session.received, received=upload_session.received), 409
+    if upload_session.received < upload_session.total_size:
+        return jsonify(session_id=upload_session.id, received=upload_session.received)
+
+    new_upload = finish_session(upload_session)
+    current_app.logger.info("User %s uploaded %s %s in chunks", current_user.id, new_upload.upload_type, new_upload.filename)
+    return jsonify(upload_id=new_upload.id, received=upload_session.total_size), 201
+
+# Uploaded files, served by content hash
+# The URL changes whenever the content does, so responses are cached for a year without revalidation.
+# Range requests (video seeking) and If-None-Match/If-Modified-Since are handled by send_file; with
+# UPLOAD_ACCEL_REDIRECT set, the front-end server (nginx) sends the file itself.
+@main.route('/media/<content_hash>/<filename>')
+def media(content_hash, filename):
+    if not re.fullmatch(r'[0-9a-f]{64}', content_hash):
+        abort(404)
+    path = blob_path(content_hash)
+    if not os.path.exists(path):
+        abort(404)
+
+    max_age = current_app.config['UPLOAD_CACHE_MAX_AGE']
+    accel_prefix = current_app.config.get('UPLOAD_ACCEL_REDIRECT')
+    if accel_prefix:
+        response = current_app.response_class(mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream')
+        response.headers['X-Accel-Redirect'] = accel_prefix.rstrip('/') + '/' + os.path.relpath(path, current_app.config['UPLOAD_STORE_FOLDER'])
+        response.headers['Content-Disposition'] = 'inline; filename="%s"' % secure_filename(filename)
+        response.cache_control.public = True
+        response.cache_control.max_age = max_age
+    else:
+        response = send_file(path, download_name=secure_filename(filename), conditional=True, etag=content_hash, max_age=max_age)
+    response.cache_control.immutable = True
+    return response
+
+# Make media_url() available in templates
+main.add_app_template_global(media_url)
 
 
 # Gallery route to display all blogs and vlogs uploaded by users
 @main.route('/gallery')
 @login_required  # Ensures that the user must be logged in to view the gallery
 def gallery():
-    blogs = Upload.query.filter_by(upload_type='blog').all()  # Get all blog uploads from the database
-    vlogs = Upload.query.filter_by(upload_type='vlog').all()  # Get all vlog uploads from the database
-    return render_template('gallery.html', blogs=blogs, vlogs=vlogs)  # Render the gallery page with the uploads
+    per_page = current_app.config.get('GALLERY_PER_PAGE', 12)
+    blog_page = request.args.get('blog_page', 1, type=int)
+    vlog_page = request.args.get('vlog_page', 1, type=int)
+
+    # Load uploaders, comments and comment authors up front instead of one lazy query per card
+    eager = (joinedload(Upload.user), selectinload(Upload.comments).joinedload(Comment.user))
+    blogs = (Upload.query.options(*eager).filter_by(upload_type='blog').order_by(Upload.id)
+             .paginate(page=blog_page, per_page=per_page, error_out=False))  # One page of blog uploads
+    vlogs = (Upload.query.options(*eager).filter_by(upload_type='vlog').order_by(Upload.id)
+             .paginate(page=vlog_page, per_page=per_page, error_out=False))  # One page of vlog uploads
+
+    # Like counts for every upload on the page in a single COUNT ... GROUP BY query
+    upload_ids = [upload.id for upload in blogs.items + vlogs.items]
+    like_counts = dict(db.session.query(Like.upload_id, func.count(Like.id))
+                       .filter(Like.upload_id.in_(upload_ids))
+                       .group_by(Like.upload_id)
+                       .all()) if upload_ids else {}
+
+    return render_template('gallery.html', blogs=blogs, vlogs=vlogs, like_counts=like_counts)  # Render the gallery page with the uploads
 
 
 # Route to delete an upload
@@ -362,16 +477,9 @@ def delete_upload(upload_id):
         flash('You do not have permission to delete this upload.', 'danger')  # Notify if the user is not the owner
         return redirect(url_for('main.gallery'))
 
-    # If the user is the owner, delete the file from the server (for blogs)
-    if upload.upload_type == 'blog':
-        upload_folder = os.path.join(os.path.dirname(__file__), 'static', 'uploads')
-        file_path = os.path.join(upload_folder, upload.filename)
-
-        # Ensure the file exists before attempting to delete it
-        if os.path.exists(file_path):
-            os.remove(file_path)  # Delete the file
-        else:
-            flash('File not found, it may have been already deleted.', 'warning')  # Notify if the file was already removed
+    # If the user is the owner, delete the file from the server (blogs and uploaded videos),
+    # unless an identical upload still shares it
+    remove_upload_file(upload)
 
     # Delete the upload record from the database
     db.session.delete(upload)
@@ -426,3 +534,12 @@ def logout():
     flash("You have been logged out.", "info")
     return redirect(url_for('main.home'))  # Redirect to the homepage after logout
 
+# Prometheus metrics for this worker process (stage timings, query counts, cache hit rates)
+@main.route('/metrics')
+def metrics_endpoint():
+    if not current_app.config.get('METRICS_ENABLED', True):
+        abort(404)
+    response = make_response(metrics.registry.render())
+    response.headers['Content-Type'] = 'text/plain; version=0.0.4; charset=utf-8'
+    return response
+
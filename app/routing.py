@@ -0,0 +1,81 @@
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+logger = logging.getLogger(__name__)
+
+# Optimize one day's route in a pool process: coordinates in, (order, swaps, moves) out
+# Only the coordinate arrays cross the process boundary; the distance matrix is built in the worker
+def _optimize_in_worker(lats, lons):
+    from app.Itinerary import optimize_order
+    return optimize_order(lats, lons)
+
+# Persistent process pool for route optimization, shared by every request in this worker process
+# (the 2-opt/Or-opt loops are pure Python, so threads alone would serialize on the GIL)
+class RoutePool:
+    def __init__(self, max_workers=None, min_stops=20):
+        self.max_workers = max_workers  # Pool processes (None = one per CPU, 0 = optimize in-process only)
+        self.min_stops = min_stops      # Days with fewer stops are optimized in-process (cheaper than dispatching)
+        self._executor = None
+        self._lock = threading.Lock()
+
+    # Configure the pool from the app settings (same pattern as the Flask extensions)
+    def init_app(self, app):
+        self.max_workers = app.config.get('ROUTE_POOL_WORKERS', self.max_workers)
+        self.min_stops = app.config.get('ROUTE_POOL_MIN_STOPS', self.min_stops)
+
+    # Pool is started on first use (after gunicorn forks); forkserver/spawn because planner threads are running
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers or os.cpu_count(),
+                                                     mp_context=multiprocessing.get_context(method))
+            return self._executor
+
+    # Drop a broken pool (e.g. a worker was killed) so the next call starts a fresh one
+    def _discard(self, executor):
+        with self._lock:
+            if self._executor is not executor:
+                return  # Already replaced by another thread
+            self._executor = None
+        logger.error('Route pool broke; optimizing in-process until a new pool is started')
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    # Optimize the visiting order of every day of an itinerary
+    # Long days are sent to the pool first, short ones are optimized here while the pool works
+    def optimize_days(self, days):
+        from app.Itinerary import opt2, poi_coordinates, record_route_moves
+
+        futures = {}
+        long_days = [i for i, day in enumerate(days) if len(day) >= max(self.min_stops, 3)]
+        if self.max_workers != 0 and long_days:
+            executor = self._get_executor()  # Not started at all while every day is short
+            try:
+                for i in long_days:
+                    futures[i] = executor.submit(_optimize_in_worker, *poi_coordinates(days[i]))
+            except BrokenProcessPool:
+                self._discard(executor)  # Days not submitted yet are optimized in-process below
+
+        optimized = []
+        for i, day in enumerate(days):
+            future = futures.get(i)
+            if future is None:
+                optimized.append(opt2(day))
+                continue
+            try:
+                order, swaps, moves = future.result()
+            except BrokenProcessPool:
+                self._discard(executor)
+                optimized.append(opt2(day))
+                continue
+            record_route_moves(swaps, moves)
+            optimized.append([day[k] for k in order])
+        return optimized
+
+
+# Process-wide route optimization pool (configured in create_app)
+route_pool = RoutePool()
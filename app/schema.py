@@ -0,0 +1,37 @@
+import logging
+from sqlalchemy import inspect, text
+from app import db
+
+logger = logging.getLogger(__name__)
+
+# Columns added to existing tables after their first release: (table, column)
+# db.create_all() only creates missing tables, so databases created earlier get these columns here
+ADDED_COLUMNS = [
+    ('upload', 'content_hash'),
+    ('itinerary', 'city'),
+    ('poi', 'position'),
+    ('poi', 'pinned'),
+    ('planning_job', 'date_started'),
+]
+
+# Bring an existing database up to date with the models (run after db.create_all())
+# Adds missing columns from ADDED_COLUMNS and creates any indexes declared on the models that do not exist yet
+def upgrade_schema():
+    inspector = inspect(db.engine)
+    tables = db.metadata.tables
+    with db.engine.begin() as connection:
+        for table_name, column_name in ADDED_COLUMNS:
+            existing = {column['name'] for column in inspector.get_columns(table_name)}
+            if column_name in existing:
+                continue
+            column = tables[table_name].columns[column_name]
+            column_type = column.type.compile(dialect=connection.dialect)
+            logger.info('Adding column %s.%s', table_name, column_name)
+            connection.execute(text('ALTER TABLE %s ADD COLUMN %s %s' % (table_name, column_name, column_type)))
+
+        for table in tables.values():
+            existing = {index['name'] for index in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in existing:
+                    logger.info('Creating index %s', index.name)
+                    index.create(connection, checkfirst=True)
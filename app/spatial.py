@@ -0,0 +1,56 @@
+import numpy as np
+from scipy.spatial import cKDTree
+from app import distance
+
+# Positions of the k smallest values, closest first (partial selection instead of a full sort)
+# Ties are broken by position, so the result is deterministic
+def k_smallest(values, k):
+    if k < len(values):
+        kth = np.partition(values, k - 1)[k - 1]
+        candidates = np.flatnonzero(values <= kth)
+    else:
+        candidates = np.arange(len(values))
+    return candidates[np.argsort(values[candidates], kind='stable')][:k]
+
+# KD-tree over the catalog's normalized coordinates, built once per catalog
+class SpatialIndex:
+    # Grow the candidate set by this factor when too few candidates pass the filter
+    GROWTH = 4
+
+    def __init__(self, points):
+        self.points = points
+        self.tree = cKDTree(points)
+
+    def __len__(self):
+        return len(self.points)
+
+    # Rows of the k points nearest to `point`, closest first
+    # `accept` is an optional vectorized predicate on row indices (e.g. "belongs to this cluster")
+    def nearest(self, point, k, accept=None):
+        want = k if accept is None else k * self.GROWTH
+        while True:
+            want = min(want, len(self))
+            dists, rows = self.tree.query(point, k=want)
+            dists, rows = np.atleast_1d(dists), np.atleast_1d(rows)
+            horizon = dists[-1]  # Every point closer than this has been returned by the query
+            if accept is not None:
+                keep = accept(rows)
+                dists, rows = dists[keep], rows[keep]
+
+            # Done once k points were found and no point tied with the k-th can lie outside the queried set
+            if want == len(self) or (len(rows) >= k and dists[k - 1] < horizon):
+                # Order by distance, then by row so equidistant points come out in catalog order
+                return rows[np.lexsort((rows, dists))][:k]
+            want *= self.GROWTH
+
+    # Rows (from `members`) of the k members nearest to `point`, closest first
+    # Uses the tree when members are dense enough in the catalog, otherwise a partial selection over the members
+    def nearest_members(self, point, k, members, is_member, max_candidates=4096):
+        k = min(k, len(members))
+        if k == 0:
+            return members[:0]
+        # Expected number of tree candidates to examine before finding k members
+        if k * len(self) <= len(members) * max_candidates:
+            return self.nearest(point, k, is_member)
+        dist = distance.squared_euclidean_to_point(self.points[members], point)
+        return members[k_smallest(dist, k)]
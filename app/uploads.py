@@ -0,0 +1,186 @@
+import hashlib
+import os
+import tempfile
+import uuid
+from datetime import datetime, timedelta
+from flask import Request, current_app, url_for
+from werkzeug.exceptions import RequestEntityTooLarge
+from app import db
+from app.models import Upload, UploadSession
+
+# File extensions accepted for each upload type
+UPLOAD_EXTENSIONS = {
+    'blog': ('.txt', '.md', '.pdf'),
+    'vlog': ('.mp4', '.mov'),
+}
+
+# Bytes read/written at a time when streaming uploads
+CHUNK_SIZE = 1024 * 1024
+
+# Upload type a file name belongs to (None if its extension is not accepted)
+def upload_kind(filename):
+    extension = os.path.splitext(filename or '')[1].lower()
+    return next((kind for kind, extensions in UPLOAD_EXTENSIONS.items() if extension in extensions), None)
+
+# Size cap for an upload type, in bytes
+def size_limit(kind):
+    return current_app.config['UPLOAD_MAX_BYTES'].get(kind, 0)
+
+# Temporary file in the upload temp folder (same filesystem as the media store, so finished files are moved, not copied)
+def _temp_file():
+    folder = current_app.config['UPLOAD_TMP_FOLDER']
+    os.makedirs(folder, exist_ok=True)
+    return tempfile.NamedTemporaryFile(dir=folder, suffix='.part', delete=False)
+
+# Write-through file for an uploaded form field: hashes and counts bytes as they are written,
+# and stops the request as soon as the upload type's size cap is exceeded
+class HashingFileWriter:
+    def __init__(self, limit):
+        self.file = _temp_file()
+        self.path = self.file.name
+        self.limit = limit
+        self.size = 0
+        self.sha256 = hashlib.sha256()
+
+    def write(self, data):
+        self.size += len(data)
+        if self.size > self.limit:
+            self.discard()
+            raise RequestEntityTooLarge()
+        self.sha256.update(data)
+        return self.file.write(data)
+
+    def discard(self):
+        self.file.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    # FileStorage reads, seeks and closes through the underlying file
+    def __getattr__(self, name):
+        return getattr(self.file, name)
+
+    # Flush the file and move it into the media store; returns its content hash
+    def save(self):
+        self.file.close()
+        content_hash = self.sha256.hexdigest()
+        store_upload(self.path, content_hash)
+        return content_hash
+
+# Request class whose multipart file fields stream straight to disk (instead of a spooled temp file
+# that file.save() then copies); the per-type cap is checked while the body is being read
+class StreamingUploadRequest(Request):
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        kind = upload_kind(filename)
+        if kind is None:
+            return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+        limit = size_limit(kind)
+        if (content_length or 0) > limit:
+            raise RequestEntityTooLarge()
+        writer = HashingFileWriter(limit)
+        self.__dict__.setdefault('_streamed_files', []).append(writer)
+        return writer
+
+    # Delete streamed files the view did not save (wrong field, rejected upload, body cut short)
+    def close(self):
+        super().close()
+        for writer in self.__dict__.pop('_streamed_files', ()):
+            writer.discard()
+
+# Location of a file in the content-addressed media store: <UPLOAD_STORE_FOLDER>/ab/cd/abcd... (SHA-256 hex)
+# Two levels of 256 shards keep directories small; the name never changes, so neither does the file
+def blob_path(content_hash):
+    return os.path.join(current_app.config['UPLOAD_STORE_FOLDER'], content_hash[:2], content_hash[2:4], content_hash)
+
+# Move a fully written upload into the media store (identical content is stored once)
+def store_upload(temp_path, content_hash):
+    path = blob_path(content_hash)
+    if os.path.exists(path):
+        os.remove(temp_path)
+        return path
+
+    os.chmod(temp_path, 0o644)  # Temp files are private; the front-end server may serve blobs directly (X-Accel-Redirect)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    os.replace(temp_path, path)
+    return path
+
+# Delete an upload's stored file unless another upload has the same content
+def remove_upload_file(upload):
+    if upload.content_hash:
+        shared = Upload.query.filter(Upload.content_hash == upload.content_hash, Upload.id != upload.id).count()
+        path = None if shared else blob_path(upload.content_hash)
+    else:
+        # Uploads from before the media store live in UPLOAD_FOLDER under their file name
+        path = os.path.join(current_app.config['UPLOAD_FOLDER'], upload.filename) if upload.filename else None
+    if path and os.path.exists(path):
+        os.remove(path)
+
+# URL an uploaded file is served from (None for vlogs that are only a link)
+def media_url(upload):
+    if upload.content_hash:
+        return url_for('main.media', content_hash=upload.content_hash, filename=upload.filename)
+    if upload.filename:
+        return url_for('static', filename='uploads/' + upload.filename)
+    return None
+
+# SHA-256 of a file on disk, read in chunks
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+# Path of the partial file behind a resumable upload session
+def session_path(upload_session):
+    return os.path.join(current_app.config['UPLOAD_TMP_FOLDER'], upload_session.id + '.part')
+
+# Start a resumable upload (the file is then sent in chunks with append_chunk)
+def create_session(user_id, kind, filename, total_size, title=None):
+    expire_sessions()
+    upload_session = UploadSession(id=uuid.uuid4().hex, user_id=user_id, upload_type=kind, filename=filename,
+                                   title=title, total_size=total_size, received=0)
+    os.makedirs(current_app.config['UPLOAD_TMP_FOLDER'], exist_ok=True)
+    open(session_path(upload_session), 'wb').close()
+    db.session.add(upload_session)
+    db.session.commit()
+    return upload_session
+
+# Append the next chunk of a resumable upload from a request body stream
+# Chunks must arrive in order; returns False (nothing written) if `offset` is not where the upload stopped
+def append_chunk(upload_session, offset, stream):
+    if offset != upload_session.received:
+        return False
+    remaining = upload_session.total_size - upload_session.received
+    with open(session_path(upload_session), 'r+b') as f:
+        f.truncate(offset)  # Drop the tail of a chunk that was interrupted mid-way
+        f.seek(offset)
+        for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+            if len(chunk) > remaining:
+                raise RequestEntityTooLarge()
+            f.write(chunk)
+            remaining -= len(chunk)
+            upload_session.received += len(chunk)
+    upload_session.date_updated = datetime.utcnow()
+    db.session.commit()
+    return True
+
+# Turn a completed resumable upload into an Upload (hashing and the move into the media store)
+def finish_session(upload_session):
+    path = session_path(upload_session)
+    content_hash = file_sha256(path)  # Chunks may come from different requests/workers, so hash the whole file once
+    store_upload(path, content_hash)
+    upload = Upload(user_id=upload_session.user_id, upload_type=upload_session.upload_type,
+                    filename=upload_session.filename, content_hash=content_hash, vlog_title=upload_session.title)
+    db.session.add(upload)
+    db.session.delete(upload_session)
+    db.session.commit()
+    return upload
+
+# Delete resumable uploads that have not received data for UPLOAD_SESSION_TTL seconds
+def expire_sessions():
+    cutoff = datetime.utcnow() - timedelta(seconds=current_app.config.get('UPLOAD_SESSION_TTL', 86400))
+    for upload_session in UploadSession.query.filter(UploadSession.date_updated < cutoff):
+        if os.path.exists(session_path(upload_session)):
+            os.remove(session_path(upload_session))
+        db.session.delete(upload_session)
+    db.session.commit()
@@ -0,0 +1,35 @@
+import gc
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Load everything the planner needs before gunicorn forks its workers (see gunicorn.conf.py)
+# The workers then share the imported modules, POI catalogs and clustering references copy-on-write
+# instead of each paying for them on its first planning request
+def warm_up(app):
+    from app import db
+    from app.catalog import city_catalogs
+    from app.clustering import clustering_backend
+    # Modules the planning and map views import on first use
+    import folium
+    import sklearn.cluster
+    from app.Itinerary import plan_itineraries
+
+    with app.app_context():
+        for city in app.config.get('WARMUP_CITIES') or [city_catalogs.default_city]:
+            try:
+                catalog = city_catalogs.get(city)
+                catalog.postings, catalog.features, catalog.spatial_index, catalog.nearby_index  # Build the lazily computed indexes
+                if clustering_backend.warm_start and clustering_backend.uses_minibatch(catalog):
+                    clustering_backend.reference_labels(catalog)
+                logger.info('Warmed up %s (%d POIs)', city, len(catalog))
+            except Exception as e:
+                logger.warning('Could not warm up %s: %s', city, e)
+
+        # Connections must not be shared with the forked workers; each opens its own
+        db.engine.dispose()
+
+    # Move everything loaded so far out of the garbage collector's reach, so collections in the
+    # workers do not touch (and copy) the shared pages
+    gc.collect()
+    gc.freeze()
@@ -0,0 +1,194 @@
+# Benchmark for the itinerary planning pipeline
+#
+# Synthesizes POI catalogs of different sizes, then times each stage separately:
+# load -> filter_pois_by_activity -> apply_kmeans -> select_representative_pois -> generate_itineraries
+# and records the peak memory allocated by each stage.
+#
+# Usage (from the project root):
+#   python benchmarks/bench_pipeline.py --sizes 1000 10000 100000 --days 1 3 7 --output bench.json
+#   python benchmarks/bench_pipeline.py --sizes 1000 --compare bench.json   # compare with an earlier run
+#   python benchmarks/bench_pipeline.py --sizes 100000 --algorithms kmeans minibatch  # clustering speed vs. inertia
+#   python benchmarks/bench_pipeline.py --sizes 100000 --store   # load from compiled POI stores instead of CSV
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.Itinerary import (ACTIVITY_COLS, filter_pois_by_activity, apply_kmeans,
+                           select_representative_pois, generate_itineraries)
+from app.catalog import POICatalog
+from app.clustering import ClusteringBackend
+from app.poi_store import build_store
+
+# Bounding box used for synthetic POIs (roughly Greater London)
+LAT_RANGE = (51.28, 51.70)
+LON_RANGE = (-0.51, 0.33)
+
+STAGES = ['load', 'filter', 'kmeans', 'select', 'generate']
+
+# Write a synthetic POI dataset with the same columns as the real one
+def synthesize_dataset(path, rows, density, seed):
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        'name': ['POI %d' % i for i in range(rows)],
+        'address': ['%d Synthetic Street, London' % i for i in range(rows)],
+    })
+    for activity in ACTIVITY_COLS:
+        df[activity] = (rng.random(rows) < density).astype(float)
+    df['Latitude'] = rng.uniform(*LAT_RANGE, rows).round(6)
+    df['Longitude'] = rng.uniform(*LON_RANGE, rows).round(6)
+    df.to_csv(path, index=False)
+
+# Build the catalog and the indexes it builds lazily, so later stages only measure per-request work
+# (POICatalog.load uses the compiled store when --store built one, otherwise it parses the CSV)
+def load_catalog(path):
+    catalog = POICatalog.load(path)
+    catalog.features
+    catalog.spatial_index
+    return catalog
+
+# Run fn once, returning (result, seconds, peak bytes allocated while it ran)
+# Memory tracing slows Python code down a lot, so timed runs and memory runs are kept separate
+def measure(fn, trace_memory=False):
+    if not trace_memory:
+        start = time.perf_counter()
+        result = fn()
+        return result, time.perf_counter() - start, None
+
+    tracemalloc.start()
+    result = fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, None, peak
+
+# Time every stage of the pipeline for one configuration (or record peak memory instead)
+def run_case(path, activities, days, pois_per_day, backend, trace_memory=False):
+    timings, peaks = {}, {}
+
+    def stage(name, fn):
+        result, timings[name], peaks[name] = measure(fn, trace_memory)
+        return result
+
+    catalog = stage('load', lambda: load_catalog(path))
+    rows = stage('filter', lambda: filter_pois_by_activity(catalog, activities))
+    backend.reference_labels(catalog)  # Built once per dataset version in the app, not per request
+    labels, kmeans = stage('kmeans', lambda: apply_kmeans(catalog, rows, days, backend))
+    representative = stage('select', lambda: select_representative_pois(catalog, rows, labels, kmeans.cluster_centers_, pois_per_day))
+    stage('generate', lambda: generate_itineraries(representative, activities, days))
+
+    return timings, peaks, {'matched_rows': int(len(rows)), 'kmeans_iterations': int(kmeans.n_iter_),
+                            'inertia': float(kmeans.inertia_)}
+
+# Git commit of the working tree (if available), recorded with the results
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def environment():
+    import sklearn
+    return {
+        'commit': git_commit(),
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'scikit-learn': sklearn.__version__,
+    }
+
+# Print the per-stage median time ratio between this run and an earlier results file
+def compare(results, baseline_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+
+    def case_key(case):
+        return (case['rows'], case['density'], case['days'], case['pois_per_day'], case.get('algorithm', 'auto'),
+                case.get('store', False))
+
+    previous = {case_key(case): case for case in baseline['results']}
+    print('\nComparison with %s (commit %s): new / old median time' % (baseline_path, baseline['environment'].get('commit')))
+    for case in results:
+        old = previous.get(case_key(case))
+        if old is None:
+            continue
+        ratios = ['%s %.2fx' % (stage, case['median_seconds'][stage] / old['median_seconds'][stage])
+                  for stage in STAGES if old['median_seconds'].get(stage)]
+        print('  rows=%d days=%d pois_per_day=%d %s: %s' % (case['rows'], case['days'], case['pois_per_day'],
+                                                         case['algorithm'], ', '.join(ratios)))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the itinerary planning pipeline.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000], help='catalog sizes (rows)')
+    parser.add_argument('--days', type=int, nargs='+', default=[1, 3, 7], help='trip lengths to sweep')
+    parser.add_argument('--pois-per-day', type=int, nargs='+', default=[5], help='POIs per day to sweep')
+    parser.add_argument('--algorithms', nargs='+', default=['auto'], choices=['auto', 'kmeans', 'minibatch'],
+                        help='clustering algorithms to sweep')
+    parser.add_argument('--density', type=float, default=0.2, help='probability that a POI has each activity')
+    parser.add_argument('--activities', default='art,museum,history', help='comma-separated activities to plan for')
+    parser.add_argument('--repeats', type=int, default=3, help='runs per configuration (median is reported)')
+    parser.add_argument('--seed', type=int, default=42, help='random seed for the synthetic catalogs')
+    parser.add_argument('--store', action='store_true', help='load the catalogs from compiled POI stores')
+    parser.add_argument('--output', help='write results as JSON to this file')
+    parser.add_argument('--compare', help='earlier results file to compare against')
+    args = parser.parse_args(argv)
+
+    activities = [a for a in args.activities.split(',') if a]
+    results = []
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for rows in args.sizes:
+            path = os.path.join(tmp, 'pois_%d.csv' % rows)
+            synthesize_dataset(path, rows, args.density, args.seed)
+            if args.store:
+                build_store(path)
+
+            for days in args.days:
+                for pois_per_day in args.pois_per_day:
+                    for algorithm in args.algorithms:
+                        backend = ClusteringBackend(algorithm=algorithm)
+                        runs = [run_case(path, activities, days, pois_per_day, backend) for _ in range(args.repeats)]
+                        _, peaks, _ = run_case(path, activities, days, pois_per_day, backend, trace_memory=True)
+                        case = {
+                            'rows': rows,
+                            'density': args.density,
+                            'activities': activities,
+                            'days': days,
+                            'pois_per_day': pois_per_day,
+                            'algorithm': algorithm,
+                            'store': args.store,
+                            'repeats': args.repeats,
+                            'median_seconds': {stage: statistics.median(run[0][stage] for run in runs) for stage in STAGES},
+                            'peak_bytes': peaks,
+                            **runs[-1][2],
+                        }
+                        results.append(case)
+                        print('rows=%-8d days=%-2d pois_per_day=%-3d %-9s %s  inertia %.1f' % (
+                            rows, days, pois_per_day, algorithm,
+                            '  '.join('%s %.4fs' % (stage, case['median_seconds'][stage]) for stage in STAGES),
+                            case['inertia']))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'environment': environment(), 'results': results}, f, indent=2)
+        print('\nResults written to %s' % args.output)
+
+    if args.compare:
+        compare(results, args.compare)
+
+if __name__ == '__main__':
+    main()
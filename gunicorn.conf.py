@@ -0,0 +1,13 @@
+# gunicorn settings (gunicorn -c gunicorn.conf.py run:app)
+# Workers and port come from the environment as usual (WEB_CONCURRENCY, PORT)
+import os
+
+# Import the app once in the master process and fork the workers from it (GUNICORN_PRELOAD=0 to disable,
+# e.g. to reload code with a HUP instead of a full restart)
+preload_app = os.environ.get('GUNICORN_PRELOAD', '1') != '0'
+
+# With preload_app, warm up the planner in the master before any worker is forked
+def when_ready(server):
+    if preload_app:
+        from app.warmup import warm_up
+        warm_up(server.app.wsgi())
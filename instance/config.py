@@ -1,7 +1,66 @@
 
 # instance/config.py
 SECRET_KEY = 'asecretkey12345678'  # Secret key used for session management and cryptographic operations like signing cookies
-SQLALCHEMY_DATABASE_URI = 'sqlite:///site.db'  # URI for the SQLite database
+SQLALCHEMY_DATABASE_URI = 'sqlite:///site.db'  # URI for the SQLite database (the DATABASE_URL environment variable overrides it, e.g. postgresql://...)
+SQLITE_WAL = True  # Use SQLite's write-ahead log so reads are not blocked while another worker writes
+SQLITE_BUSY_TIMEOUT = 30  # Seconds a SQLite write waits for another worker's lock before failing with "database is locked"
+SQLITE_PRAGMAS = {'cache_size': -65536, 'temp_store': 'MEMORY'}  # Extra pragmas for every SQLite connection (cache_size < 0 is in KiB)
+DATABASE_POOL_SIZE = 5  # Connections kept open per worker process (PostgreSQL and other servers)
+DATABASE_MAX_OVERFLOW = 10  # Extra connections opened under load beyond the pool size
+DATABASE_POOL_TIMEOUT = 30  # Seconds to wait for a free connection before failing
+DATABASE_POOL_RECYCLE = 1800  # Seconds after which a connection is replaced (avoids server-side idle timeouts)
 SQLALCHEMY_TRACK_MODIFICATIONS = False  # Disables Flask-SQLAlchemy's modification tracking to save resources
+CITY_DATASET_DIR = None  # Directory of <City>_*.csv datasets (None = the directory of POI_DATASET_PATH)
+DEFAULT_CITY = None  # City used when a request names none (None = the city of POI_DATASET_PATH, i.e. London)
+WARMUP_CITIES = None  # Cities loaded in the gunicorn master before workers fork (None = the default city only)
+MAX_LOADED_CITIES = 8  # City catalogs kept in memory per worker; the least recently used city is unloaded first
+CLUSTER_CACHE_SIZE = 256  # Number of clustering results (activity set + days) kept in memory per worker
+CLUSTER_CACHE_DIR = None  # Optional directory to persist clustering results across restarts (None = memory only)
+CLUSTERING_ALGORITHM = 'auto'  # 'kmeans', 'minibatch', or 'auto' (MiniBatchKMeans when CLUSTERING_MINIBATCH_THRESHOLD POIs or more match the request)
+CLUSTERING_MINIBATCH_THRESHOLD = 150000  # Matching POIs from which 'auto' switches to MiniBatchKMeans (below it full KMeans is faster and tighter)
+CLUSTERING_N_INIT = 'auto'  # KMeans restarts per request ('auto' = scikit-learn default)
+CLUSTERING_MAX_ITER = 300  # Maximum KMeans iterations (MiniBatchKMeans epochs) per request
+CLUSTERING_BATCH_SIZE = 4096  # MiniBatchKMeans batch size
+CLUSTERING_MINIBATCH_TOL = 0.001  # MiniBatchKMeans stops early once its centers move less than this (lower = slower, closer to full KMeans)
+CLUSTERING_WARM_START = True  # Seed MiniBatchKMeans from a reference clustering of the whole catalog
+CLUSTERING_REFERENCE_CLUSTERS = 64  # Clusters in that reference clustering (computed once per dataset version)
+CLUSTERING_REFERENCE_SAMPLE = 100000  # POIs sampled to fit the reference clustering
+PLANNING_WORKERS = 2  # Background threads per worker process that generate itineraries
+ROUTE_POOL_WORKERS = 0  # Processes optimizing long days' routes in parallel per worker (None = one per CPU, 0 = no pool); opt-in, see below
+ROUTE_POOL_MIN_STOPS = 20  # Days with fewer stops are optimized in the request thread (dispatch costs more below ~20 stops); only reachable if MAX_POIS_PER_DAY is raised to at least this
+PLAN_USER_RATE = 6  # Plans per minute each user may request (per worker process); excess requests get 429 + Retry-After
+PLAN_USER_BURST = 3  # Plans a user may request at once after being idle
+PLAN_GLOBAL_RATE = 60  # Plans per minute for all users together (per worker process)
+PLAN_GLOBAL_BURST = 20  # Plans all users together may request at once
+PLAN_API_RATE = 600  # Plans per minute each /api/itineraries caller may run (per worker process), instead of the two limits above
+PLAN_API_BURST = 60  # API plans a caller may run after being idle before PLAN_API_RATE applies
+MAX_CONCURRENT_PLANS = 8  # Plans queued or running at once per worker process (0 = no limit)
+MAX_TRIP_DAYS = 7  # Longest trip that can be planned (days = KMeans clusters)
+MAX_POIS_PER_DAY = 10  # Most POIs per day an API request may ask for
+PLANNING_JOB_TIMEOUT = 300  # Seconds a planning job may run before it is reported as failed
+PLANNING_QUEUE_TIMEOUT = 1800  # Seconds a queued planning job may wait for a planner thread before it is reported as failed (e.g. its worker restarted)
+DRAFT_TTL = 24 * 3600  # Seconds a generated itinerary is kept on the server for the user to save
+MAX_DRAFTS_PER_USER = 20  # Generated itineraries kept per user; older ones are deleted when a new plan is queued
+API_KEYS = {}  # API key -> username, for partners calling /api with "Authorization: Bearer <key>"
+API_WORKERS = 4  # Threads per worker process planning API requests in parallel
+API_MAX_BATCH = 1000  # Maximum planning requests in one /api/itineraries call
+MAX_CONTENT_LENGTH = 1024 * 1024 * 1024  # Largest request body accepted (1 GiB); bigger requests are rejected before they are read
+UPLOAD_MAX_BYTES = {'blog': 20 * 1024 * 1024, 'vlog': 1024 * 1024 * 1024}  # Size cap per upload type, checked while the file streams in
+UPLOAD_STORE_FOLDER = None  # Content-addressed media store for uploaded files (None = app/media)
+UPLOAD_CACHE_MAX_AGE = 365 * 24 * 3600  # Browser/CDN cache lifetime for /media responses (the URL changes with the content)
+UPLOAD_ACCEL_REDIRECT = None  # Internal nginx location mapped to UPLOAD_STORE_FOLDER (e.g. '/protected-media'); nginx then sends files itself
+USE_X_SENDFILE = False  # Let Apache/lighttpd send /media files (X-Sendfile) instead of the Python worker
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024  # Chunk size used by the upload page for resumable uploads of large vlogs
+UPLOAD_SESSION_TTL = 24 * 3600  # Seconds an unfinished resumable upload is kept without receiving data
+ALTERNATIVES_COUNT = 5  # Nearby alternatives suggested per POI by default (?k= overrides it)
+ALTERNATIVES_MAX = 20  # Largest k accepted; more than the precomputed lists hold (python -m app.neighbors --k) are computed on demand
+ITINERARIES_PER_PAGE = 10  # Saved itineraries shown per page
+GALLERY_PER_PAGE = 12  # Blogs (and vlogs) shown per gallery page
+MAP_CACHE_SIZE = 128  # Rendered itinerary maps kept in memory per worker
+MAP_CACHE_DIR = None  # Optional directory to store rendered maps on disk, shared by all workers (None = memory only)
+METRICS_ENABLED = True  # Expose Prometheus metrics at /metrics
+PROFILE_SAMPLE_RATE = 0  # Fraction of requests run under cProfile (0 = profiling off)
+PROFILE_SLOW_REQUEST_SECONDS = 1.0  # Sampled requests slower than this have their profile written to PROFILE_DIR
+PROFILE_DIR = None  # Directory for .prof dumps of slow requests (None = profiling off)
 
 